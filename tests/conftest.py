@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+import json
+import os
+import random
+import sys
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # run from a source checkout
+
+"""
+Sample XMind maps generated for the tests, each one both as a legacy XMind 8 file and as a XMind zen file
+"""
+
+CONTENT_XML_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+                    '<xmap-content xmlns="urn:xmind:xmap:xmlns:content:2.0" '
+                    'xmlns:fo="http://www.w3.org/1999/XSL/Format" xmlns:svg="http://www.w3.org/2000/svg" '
+                    'xmlns:xhtml="http://www.w3.org/1999/xhtml" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                    'timestamp="1" version="2.0">')
+
+MARKERS = ['priority-1', 'priority-2', 'priority-3', 'symbol-right', 'symbol-wrong', 'c_simbol-pause',
+           'symbol-minus', 'task-half', 'flag-red', 'smiley-laugh']
+LABELS = ['auto', '自动', '手动', 'manual', '#auto', 'other']
+
+
+def make_topic_tree(rnd, depth, width, prefix='T'):
+    """A random topic tree of dicts: id, title, note, markers, label, comment, link, children, detached"""
+    count = [0]
+
+    def make_topic(path):
+        count[0] += 1
+        topic = {'id': '{}-{}'.format(prefix, count[0]), 'title': '{}{}'.format(prefix, path)}
+        r = rnd.random()
+        if r < 0.08:
+            topic['title'] = rnd.choice('#!！') + topic['title']
+        elif r < 0.12:
+            topic['title'] = '   '
+        if rnd.random() < 0.2:
+            topic['note'] = rnd.choice(['note {}\nsecond line'.format(path), '#ignored note', ' <b>&"note"</b> '])
+        if rnd.random() < 0.3:
+            topic['markers'] = rnd.sample(MARKERS, rnd.randint(1, 2))
+        if rnd.random() < 0.1:
+            topic['label'] = rnd.choice(LABELS)
+        if rnd.random() < 0.1:
+            topic['comment'] = ['comment on {}'.format(path)] + (['!ignored'] if rnd.random() < 0.3 else [])
+        if rnd.random() < 0.03:
+            topic['link'] = rnd.choice(['http://example.com', 'xmind:#abc', 'xap:attachments/a.txt'])
+        if rnd.random() < 0.02:
+            topic['detached'] = [{'id': topic['id'] + '-detached', 'title': 'floating'}]
+        return topic
+
+    root = make_topic('')
+    stack = [(root, 0, '')]
+
+    while stack:
+        topic, level, path = stack.pop()
+        if level < depth:
+            topic['children'] = [make_topic('{}.{}'.format(path, i)) for i in range(rnd.randint(1 if level < 2 else 0, width))]
+            stack.extend((child, level + 1, '{}.{}'.format(path, i)) for i, child in enumerate(topic['children']))
+
+    return root
+
+
+def make_chain(length, width=1, prefix='D'):
+    """A topic tree `length` levels deep, each level has `width` topics and continues from the first one"""
+    root = topic = {'id': prefix, 'title': prefix + ' root'}
+
+    for level in range(length):
+        topic['children'] = [{'id': '{}-{}-{}'.format(prefix, level, i), 'title': 'level {} topic {}'.format(level, i),
+                              'label': LABELS[(level + i) % len(LABELS)] if i == 1 else None,
+                              'note': 'note {}'.format(level) if level % 3 == 0 else None}
+                             for i in range(width)]
+        topic = topic['children'][0]
+
+    return root
+
+
+def sample_sheets(seed, sheets=3, depth=5, width=4, separators='/ -&>+'):
+    """sheets of random topic trees, the root title of each one ends with one of the separators (' ' for none),
+    the last sheet of several is blank"""
+    rnd = random.Random(seed)
+    result = []
+
+    for s in range(sheets):
+        root = make_topic_tree(rnd, depth, width, prefix='S{}-'.format(s))
+        root['title'] = 'Product{}{}'.format(s, separators[(seed + s) % len(separators)]).strip()
+        if s == sheets - 1 and sheets > 1:
+            root.pop('children', None)
+        result.append(('Sheet {}'.format(s), root))
+
+    return result
+
+
+def write_legacy_map(path, sheets):
+    """Write the sheets [(title, root topic)] to a legacy XMind 8 file, the comments are in comments.xml"""
+    content, comments = [CONTENT_XML_HEAD], []
+
+    for i, (title, root) in enumerate(sheets):
+        content.append('<sheet id="sheet{}" timestamp="1">'.format(i))
+        stack = [(root, True)]
+
+        while stack:
+            entry = stack.pop()
+
+            if isinstance(entry, str):  # the end tags
+                content.append(entry)
+                continue
+
+            topic, is_root = entry
+            attrs = ' id={}'.format(quoteattr(topic['id']))
+            if is_root:
+                attrs += ' structure-class="org.xmind.ui.logic.right"'
+            if topic.get('link'):
+                attrs += ' xlink:href={}'.format(quoteattr(topic['link']))
+            content.append('<topic{}><title>{}</title>'.format(attrs, escape(topic['title'])))
+            if topic.get('note'):
+                content.append('<notes><plain>{}</plain></notes>'.format(escape(topic['note'])))
+            if topic.get('markers'):
+                content.append('<marker-refs>{}</marker-refs>'.format(
+                    ''.join('<marker-ref marker-id="{}"/>'.format(m) for m in topic['markers'])))
+            if topic.get('label'):
+                content.append('<labels><label>{}</label></labels>'.format(escape(topic['label'])))
+            comments.extend((topic['id'], c) for c in topic.get('comment', []))
+
+            children = [('attached', topic['children'])] if topic.get('children') else []
+            if topic.get('detached'):
+                children.append(('detached', topic['detached']))
+
+            stack.append('</children></topic>' if children else '</topic>')
+            if children:
+                content.append('<children>')
+                for topics_type, topics in reversed(children):
+                    stack.append('</topics>')
+                    stack.extend((child, False) for child in reversed(topics))
+                    stack.append('<topics type="{}">'.format(topics_type))
+
+        content.append('<title>{}</title></sheet>'.format(escape(title)))
+
+    content.append('</xmap-content>')
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('content.xml', ''.join(content))
+        z.writestr('META-INF/manifest.xml', '<manifest/>')
+        if comments:
+            z.writestr('comments.xml', '<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+                                       '<comments xmlns="urn:xmind:xmap:xmlns:comments:2.0" version="2.0">' +
+                       ''.join('<comment author="me" object-id="{}" time="1"><content>{}</content></comment>'.format(
+                           i, escape(c)) for i, c in comments) + '</comments>')
+
+
+def write_zen_map(path, sheets):
+    """Write the sheets [(title, root topic)] to a XMind zen file, it has no comments"""
+
+    def zen_topic(topic):
+        result = {'id': topic['id'], 'class': 'topic', 'title': topic['title']}
+        if topic.get('note'):
+            result['notes'] = {'plain': {'content': topic['note']}}
+        if topic.get('markers'):
+            result['markers'] = [{'markerId': m} for m in topic['markers']]
+        if topic.get('label'):
+            result['labels'] = [topic['label']]
+        if topic.get('link'):
+            result['href'] = topic['link']
+        return result
+
+    content = []
+
+    for i, (title, root) in enumerate(sheets):
+        root_topic = dict(zen_topic(root), structureClass='org.xmind.ui.logicchart')
+        stack = [(root, root_topic)]
+
+        while stack:
+            topic, result = stack.pop()
+            children = {}
+            for topics_type, zen_type in (('children', 'attached'), ('detached', 'detached')):
+                if topic.get(topics_type):
+                    children[zen_type] = [zen_topic(t) for t in topic[topics_type]]
+                    stack.extend(zip(topic[topics_type], children[zen_type]))
+            if children:
+                result['children'] = children
+
+        content.append({'id': 'sheet{}'.format(i), 'class': 'sheet', 'title': title, 'rootTopic': root_topic})
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        # the json encoder recurses, deep maps are only written by orjson or with a higher recursion limit
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 100000))
+        try:
+            z.writestr('content.json', json.dumps(content, ensure_ascii=False))
+        finally:
+            sys.setrecursionlimit(limit)
+        z.writestr('metadata.json', '{}')
+
+
+SAMPLE_MAPS = {
+    'small': lambda: sample_sheets(1, sheets=4, depth=4, width=3),
+    'medium': lambda: sample_sheets(2, sheets=3, depth=6, width=4),
+    'separators': lambda: sample_sheets(5, sheets=7, depth=3, width=3),
+    'wide': lambda: [('Wide', dict(make_chain(3, width=300, prefix='W'), title='Wide/'))],
+    'deep': lambda: [('Deep', dict(make_chain(300, width=2, prefix='D'), title='Deep-')),
+                     ('Deeper', dict(make_chain(600, width=1, prefix='E'), title='Deeper'))],
+}
+
+
+@pytest.fixture(scope='session')
+def sample_maps(tmp_path_factory):
+    """{(name, 'legacy' or 'zen'): the path of the sample map}"""
+    folder = tmp_path_factory.mktemp('maps')
+    maps = {}
+
+    for name, make_sheets in SAMPLE_MAPS.items():
+        sheets = make_sheets()
+        for kind, write_map in (('legacy', write_legacy_map), ('zen', write_zen_map)):
+            path = str(folder / '{}_{}.xmind'.format(name, kind))
+            write_map(path, sheets)
+            maps[name, kind] = path
+
+    return maps
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+import os
+import pickle
+
+from xmindparser import open_xmind_document
+from xmind2testcase import cache
+from xmind2testcase.utils import get_xmind_testsuites
+
+"""
+The caches of the parsed testsuites
+"""
+
+
+def test_memory_cache_is_opt_in(sample_maps):
+    """Without `enable_memory_cache`, each call parses its own testsuites, the changes of a caller are never seen"""
+    path = sample_maps['small', 'legacy']
+    assert cache.memory_cache is None
+
+    testsuites = get_xmind_testsuites(path)
+    expected = [suite.to_dict() for suite in testsuites]
+    suite = next(suite for suite in testsuites if suite.sub_suites)
+    suite.name = 'mutated'
+    suite.sub_suites[-1].testcase_list.clear()
+
+    assert [suite.to_dict() for suite in get_xmind_testsuites(path)] == expected
+
+
+def test_memory_cache_hit(sample_maps):
+    path = sample_maps['small', 'zen']
+    memory_cache = cache.enable_memory_cache()
+
+    try:
+        testsuites = get_xmind_testsuites(path)
+        assert get_xmind_testsuites(path) is testsuites
+        assert memory_cache.statistics()['hits'] == 1
+    finally:
+        cache.disable_memory_cache()
+
+
+def test_incremental_cache_budget(sample_maps):
+    """The states are dropped beyond the content size budget, a file larger than the budget is never kept"""
+    paths = [sample_maps['small', 'legacy'], sample_maps['medium', 'legacy'], sample_maps['small', 'zen']]
+    sizes = []
+
+    for path in paths:
+        with open_xmind_document(path) as document:
+            sizes.append(cache.content_size_of(document))
+
+    incremental_cache = cache.IncrementalCache(max_size=sizes[1] + sizes[2])
+    states = [incremental_cache.state_of(path) for path in paths]
+
+    assert states[0].size == sizes[0]
+    assert incremental_cache.statistics()['files'] == 2
+    assert incremental_cache.size == sizes[1] + sizes[2]
+    assert incremental_cache.state_of(paths[2]) is states[2]
+    assert incremental_cache.state_of(paths[0]) is not states[0]
+
+    assert cache.IncrementalCache(max_size=sizes[1] - 1).state_of(paths[1]) is None
+
+
+def test_disk_cache_round_trip(sample_maps, tmp_path):
+    path = sample_maps['medium', 'zen']
+    disk_cache = cache.DiskCache(str(tmp_path))
+    testsuites = get_xmind_testsuites(path)
+    key = disk_cache.key_of(path)
+    disk_cache.set(key, testsuites)
+
+    assert os.listdir(str(tmp_path)) == [key + '.json']
+    assert [suite.to_dict() for suite in disk_cache.get(key)] == [suite.to_dict() for suite in testsuites]
+
+
+def test_disk_cache_only_decodes(tmp_path):
+    """A file which is no cached testsuites, e.g. a pickle dropped in the folder, is removed instead of loaded"""
+    disk_cache = cache.DiskCache(str(tmp_path))
+    payload = pickle.dumps(os.system)
+    (tmp_path / 'a.json').write_bytes(payload)
+    (tmp_path / 'b.json').write_text('{"name": "not a list of testsuites"}')
+    (tmp_path / 'c.pickle').write_bytes(payload)
+
+    assert disk_cache.get('a') is None
+    assert disk_cache.get('b') is None
+    disk_cache.evict()
+    assert os.listdir(str(tmp_path)) == []
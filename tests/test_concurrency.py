@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import xmindparser
+from xmind2testcase.parser import ConversionOptions, xmind_to_testsuites
+
+"""
+Many files parsed and converted at once in a thread pool give the same results as one by one
+"""
+
+THREADS = 16
+
+
+def run_in_threads(func, args_list):
+    with ThreadPoolExecutor(THREADS) as executor:
+        return list(executor.map(lambda args: func(*args), args_list))
+
+
+def flatten(data):
+    """the values of nested dicts and lists in order, with their keys and sizes, the deep maps can't be compared by =="""
+    result, stack = [], [(False, data)]
+
+    while stack:
+        is_key, value = stack.pop()
+        if is_key:
+            result.append(('key', value))
+        elif isinstance(value, dict):
+            result.append(('dict', len(value)))
+            for k, v in reversed(list(value.items())):
+                stack.extend(((False, v), (True, k)))
+        elif isinstance(value, (list, tuple)):
+            result.append(('list', len(value)))
+            stack.extend((False, v) for v in reversed(value))
+        else:
+            result.append(value)
+
+    return result
+
+
+def parse(path):
+    return flatten([xmindparser.xmind_to_dict(path), xmindparser.xmind_to_data(path)])
+
+
+def test_parse_files_in_threads(sample_maps):
+    """Each file has its own parse context, the readers share no state"""
+    paths = sorted(sample_maps.values())
+    expected = {path: parse(path) for path in paths}
+    jobs = [(path,) for path in paths] * 8
+
+    results = run_in_threads(parse, jobs)
+
+    for (path,), result in zip(jobs, results):
+        assert result == expected[path], path
+
+
+def test_convert_files_in_threads(sample_maps):
+    """Each sheet sets its own separator on a copy of the options, concurrent conversions never see it"""
+    paths = sorted(sample_maps.values())
+    options_list = [None, ConversionOptions(sep='>'), ConversionOptions(ignore_char='#'),
+                    ConversionOptions(precondition_sep=' | ', summary_sep=' + ')]
+
+    def convert(path, options):
+        return flatten([suite.to_dict() for suite in
+                        xmind_to_testsuites(xmindparser.xmind_to_data(path, compact=True), options)])
+
+    jobs = list(itertools.product(paths, options_list))
+    expected = {(path, repr(options)): convert(path, options) for path, options in jobs}
+    passed_options = [options.to_dict() for options in options_list if options]
+    jobs = jobs * 4
+
+    results = run_in_threads(convert, jobs)
+
+    for (path, options), result in zip(jobs, results):
+        assert result == expected[path, repr(options)], (path, options)
+
+    assert [options.to_dict() for options in options_list if options] == passed_options
+
+
+@pytest.mark.parametrize('sep', [None, '|'])
+def test_sheet_separators(sample_maps, sep):
+    """The titles of each sheet are joined by the separator at the end of its root title, options.sep without one"""
+    path = sample_maps['separators', 'legacy']
+    options = ConversionOptions(sep=sep)
+    default_separator = ' {} '.format(options.sep) if options.sep != ' ' else ' '
+    sheets = xmindparser.xmind_to_data(path, compact=True)
+    separators = {}
+
+    for sheet in sheets:
+        title = sheet['topic']['title']
+        if sheet['topic'].get('topics'):
+            separators[title.rstrip('/-&>+')] = ' {} '.format(title[-1]) if title[-1] in '/-&>+' else default_separator
+
+    assert len(set(separators.values())) > 2
+
+    results = run_in_threads(lambda: xmind_to_testsuites(xmindparser.xmind_to_data(path, compact=True), options),
+                             [()] * THREADS)
+
+    for testsuites in results:
+        used_separators = set()
+
+        for suite in testsuites:
+            separator = separators[suite.name]
+            other_separators = set(separators.values()) - {separator, ' '}
+            names = [testcase.name for sub_suite in suite.sub_suites for testcase in sub_suite.testcase_list]
+
+            if any(separator in name for name in names):
+                used_separators.add(separator)
+            for name in names:
+                assert not any(s in name for s in other_separators), (suite.name, name)
+
+        assert used_separators == set(separators.values())
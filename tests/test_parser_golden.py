@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+import pytest
+
+import xmindparser
+from xmind2testcase.parser import ConversionOptions, add_to_testcase_prefix, gen_testcase_preconditions, \
+    gen_testcase_summary, gen_testcase_title, get_execution_type, is_testcase_topic, recurse_parse_testcase, \
+    sub_topics_of
+
+"""
+The prefixes carried down the topic tree give the same testcases as joining all the ancestors of each one
+"""
+
+OPTIONS = [ConversionOptions(),
+           ConversionOptions(sep='/'),
+           ConversionOptions(sep='-', precondition_sep=' | ', summary_sep=' + ', ignore_char='#')]
+
+
+def golden_prefix(topics, options):
+    """the (title, preconditions, summary, execution type) of the topics as they were generated before the prefixes"""
+    return (gen_testcase_title(topics, options), gen_testcase_preconditions(topics, options),
+            gen_testcase_summary(topics, options), get_execution_type(topics, options))
+
+
+def iter_paths(topic, options):
+    """yield (the topics from `topic` down to each of its sub topics, the prefix of its parent) in pre-order"""
+    stack = [(topic, [], ('', '', '', 1))]
+
+    while stack:
+        topic, parents, parent_prefix = stack.pop()
+        topics = parents + [topic]
+        yield topics, parent_prefix
+
+        prefix = add_to_testcase_prefix(parent_prefix, topic, options)
+        stack.extend((child, topics, prefix) for child in reversed(sub_topics_of(topic, options)))
+
+
+@pytest.mark.parametrize('options', OPTIONS, ids=repr)
+@pytest.mark.parametrize('name', ['deep', 'wide', 'medium'])
+def test_add_to_testcase_prefix(sample_maps, name, options):
+    count = 0
+
+    for sheet in xmindparser.xmind_to_data(sample_maps[name, 'legacy'], compact=True):
+        for topics, parent_prefix in iter_paths(sheet['topic'], options):
+            assert add_to_testcase_prefix(parent_prefix, topics[-1], options) == golden_prefix(topics, options), \
+                [t['id'] for t in topics]
+            count += 1
+
+    assert count > 100
+
+
+@pytest.mark.parametrize('options', OPTIONS, ids=repr)
+@pytest.mark.parametrize('name', ['deep', 'wide', 'medium'])
+def test_recurse_parse_testcase(sample_maps, name, options):
+    count = 0
+
+    for sheet in xmindparser.xmind_to_data(sample_maps[name, 'legacy'], compact=True):
+        for suite_dict in sub_topics_of(sheet['topic'], options):
+            for case_dict in sub_topics_of(suite_dict, options):
+                expected = [golden_prefix(topics, options) for topics, _ in iter_paths(case_dict, options)
+                            if is_testcase_topic(topics[-1], options=options) and
+                            not any(is_testcase_topic(t, options=options) for t in topics[:-1])]
+                testcases = [(case.name, case.preconditions, case.summary, case.execution_type)
+                             for case in recurse_parse_testcase(case_dict, options=options)]
+
+                assert testcases == [(title, preconditions or '无', summary or title, exe_type)
+                                     for title, preconditions, summary, exe_type in expected]
+                count += len(testcases)
+
+    assert count > 100
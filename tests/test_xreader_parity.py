@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+import pytest
+
+import xmindparser
+from conftest import SAMPLE_MAPS
+
+"""
+The in-tree legacy reader gives the same data as the `xmind` package it replaced in `get_xmind_testsuites`
+"""
+
+xmind = pytest.importorskip('xmind')  # not a requirement anymore, install it to check the parity
+
+
+# the xmind package recurses once per level, it can't read the deep sample map
+@pytest.mark.parametrize('name', [name for name in SAMPLE_MAPS if name != 'deep'])
+def test_xmind_to_data_is_xmind_load_data(sample_maps, name):
+    path = sample_maps[name, 'legacy']
+    assert xmindparser.xmind_to_data(path) == xmind.load(path).getData()
+
+
+@pytest.mark.parametrize('name', [name for name in SAMPLE_MAPS if name != 'deep'])
+def test_compact_topics_are_xmind_load_data(sample_maps, name):
+    path = sample_maps[name, 'legacy']
+    expected = xmind.load(path).getData()
+    sheets = xmindparser.xmind_to_data(path, compact=True)
+    topic_keys = ('id', 'title', 'note', 'label', 'comment', 'markers', 'link', 'image')
+
+    def topic_data(topic):
+        data = {k: list(topic[k]) if k == 'markers' else topic[k] for k in topic_keys}
+        data['topics'] = [topic_data(t) for t in topic.get('topics', [])]
+        return data
+
+    def expected_data(topic):
+        data = {k: topic.get(k) for k in topic_keys}
+        data['markers'] = [m for m in data['markers'] if m]
+        data['topics'] = [expected_data(t) for t in topic.get('topics', [])]
+        return data
+
+    assert [topic_data(s['topic']) for s in sheets] == [expected_data(s['topic']) for s in expected]
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+import pytest
+
+import xmindparser
+from xmindparser import zenreader
+
+"""
+content.json decoded at once or one sheet at a time
+"""
+
+
+@pytest.mark.parametrize('name', ['small', 'medium', 'separators'])
+def test_streamed_sheets_are_loaded_sheets(sample_maps, monkeypatch, name):
+    path = sample_maps[name, 'zen']
+    monkeypatch.setattr(zenreader, 'max_load_size', 1 << 40)
+    loaded = xmindparser.xmind_to_dict(path)
+
+    monkeypatch.setattr(zenreader, 'max_load_size', 0)
+    assert xmindparser.xmind_to_dict(path) == loaded
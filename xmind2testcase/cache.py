@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import xmindparser
+from xmindparser import codec
+from xmind2testcase import parser
+from xmind2testcase.metadata import TestSuite
+
+"""
+Caches of the testsuites parsed from XMind files: an in-process LRU and a persistent on-disk cache
+"""
+
+# bump it whenever the parsed testsuite structure changes, older cache files are never loaded then
+cache_version = 3
+
+
+def options_signature(options=None):
+    """The cache version and the conversion options, which the parsed testsuites depend on"""
+    options = options or parser.ConversionOptions()
+    return json.dumps([cache_version, options.to_dict(), xmindparser.config], sort_keys=True)
+
+
+class MemoryCache(object):
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        """
+        MemoryCache
+        :param max_size: the memory budget in bytes (estimated), the least recently used testsuites are dropped first
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_of(xmind_file, sheets=None, options=None):
+        """An unchanged file has the same path, mtime and size, `sheets` is the selection of parsed sheets"""
+        stat = os.stat(xmind_file)
+        return xmind_file, stat.st_mtime_ns, stat.st_size, options_signature(options), repr(sheets)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key, None)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, testsuites):
+        size = estimate_size(testsuites)
+
+        with self._lock:
+            # the older versions of the same file will never be hit again, other sheets or options of it still may
+            for old_key in [k for k in self._entries if k[0] == key[0] and k[1:3] != key[1:3]]:
+                self.size -= self._entries.pop(old_key)[1]
+
+            if size > self.max_size:
+                return
+
+            self._entries[key] = (testsuites, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.size -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def statistics(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                'size': self.size, 'max_size': self.max_size}
+
+
+def estimate_size(testsuites):
+    """A rough estimate of the memory used by testsuites in bytes"""
+    size = 0
+    objects = list(testsuites)
+
+    while objects:
+        obj = objects.pop()
+        size += sys.getsizeof(obj)
+
+        for name in type(obj).__slots__:
+            value = getattr(obj, name)
+            if isinstance(value, list):
+                size += sys.getsizeof(value)
+                objects.extend(value)
+            elif isinstance(value, (str, dict)):
+                size += sys.getsizeof(value)
+
+    return size
+
+
+# the enabled `MemoryCache`, see `enable_memory_cache`
+memory_cache = None
+
+# the enabled `DiskCache`, see `enable_disk_cache`
+disk_cache = None
+
+# the enabled `IncrementalCache`, see `enable_incremental_cache`
+incremental_cache = None
+
+
+class DiskCache(object):
+
+    def __init__(self, folder, max_size=64 * 1024 * 1024):
+        """
+        DiskCache, the testsuites are stored as the json of their `to_dict` data, loading it never runs any code
+        :param folder: the folder to store the cache files
+        :param max_size: the max total size of the cache files in bytes, the least recently used files are removed first
+        """
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(folder, exist_ok=True)
+
+    def key_of(self, xmind_file, sheets=None, options=None):
+        """Hash the XMind file content together with the cache version, the conversion options and the parsed sheets"""
+        sha1 = hashlib.sha1()
+
+        with open(xmind_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+
+        sha1.update(options_signature(options).encode('utf-8'))
+
+        if sheets is not None:
+            sha1.update(repr(sheets).encode('utf-8'))
+        return sha1.hexdigest()
+
+    def get(self, key):
+        """Load the testsuites stored with the key, return None if there is no valid cache file"""
+        cache_file = self._cache_file(key)
+
+        try:
+            with open(cache_file, 'rb') as f:
+                testsuites = [TestSuite.from_dict(data) for data in codec.loads(f.read())]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning('Remove the broken cache file(%s): %s', cache_file, e)
+            self._remove(cache_file)
+            return None
+
+        try:
+            os.utime(cache_file)  # mark it as recently used
+        except OSError:
+            pass  # e.g. evicted meanwhile by another conversion
+
+        return testsuites
+
+    def set(self, key, testsuites):
+        """Store the testsuites with the key, then evict the least recently used files beyond max_size
+
+        A failure to store them is only logged, it never fails the conversion.
+        """
+        cache_file = self._cache_file(key)
+        temp_file = None
+
+        try:
+            # a unique temporary file, the same key may be stored by several threads or processes at once
+            fd, temp_file = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+            os.close(fd)
+            codec.dump_file([suite.to_dict() for suite in testsuites], temp_file, ensure_ascii=False, compact=True)
+
+            if os.path.getsize(temp_file) > self.max_size:
+                logging.info('The testsuites are too large for the disk cache(%s), skip it', self.folder)
+                return
+
+            os.replace(temp_file, cache_file)
+            temp_file = None
+            self.evict()
+        except (OSError, ValueError) as e:  # e.g. a lone surrogate can't be encoded in utf-8
+            logging.warning('Failed to store the testsuites in the disk cache(%s): %s', self.folder, e)
+        finally:
+            if temp_file is not None:
+                self._remove(temp_file)
+
+    def evict(self):
+        cache_files = []
+
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.pickle'):
+                self._remove(entry.path)  # the cache files of the older versions are never loaded
+            elif entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # removed meanwhile by another conversion
+
+                cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in cache_files)
+
+        for _, size, cache_file in sorted(cache_files):
+            if total_size <= self.max_size:
+                break
+
+            self._remove(cache_file)
+            total_size -= size
+
+    def _cache_file(self, key):
+        return os.path.join(self.folder, key + '.json')
+
+    @staticmethod
+    def _remove(cache_file):
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+
+
+def content_size_of(document):
+    """The uncompressed size of the content (content.json or content.xml) of an opened XMind document in bytes"""
+    name = 'content.json' if document.is_zen else 'content.xml'
+    return document.size_of(name) if name in document else 0
+
+
+class IncrementalState(object):
+
+    def __init__(self):
+        """
+        IncrementalState, what the last conversion of a XMind file left to reuse, each one a `xmindparser.SubtreeCache`
+        subtrees: the converted topic subtrees below the root topics by their fingerprints
+        testsuites: the parsed sub testsuites by their topics
+        rows: the rendered rows of the exports by their sub testsuites
+        size: the uncompressed size of the content of the XMind file, which weighs the state in `IncrementalCache`
+        """
+        self.subtrees = xmindparser.SubtreeCache()
+        self.testsuites = xmindparser.SubtreeCache()
+        self.rows = xmindparser.SubtreeCache()
+        self.size = 0
+
+
+class IncrementalCache(object):
+
+    def __init__(self, max_files=16, max_size=16 * 1024 * 1024):
+        """
+        IncrementalCache, an edited XMind file is converted again by reusing the unchanged subtrees of its last conversion
+        :param max_files: the number of XMind files (with their conversion options) to keep, the least recently used first
+        :param max_size: the budget of the kept states, the total uncompressed size in bytes of the content (content.xml
+                         or content.json) of their XMind files, a state takes about 3 to 6 times that in memory.
+                         The least recently used states are dropped first, a larger file is never kept.
+        """
+        self.max_files = max_files
+        self.max_size = max_size
+        self.size = 0
+        self._states = OrderedDict()
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_source(self, xmind_file, source_file):
+        """Convert the XMind file with the state of the source file, e.g. an uploaded copy of a file shares
+        the state of the file it was copied from, so the copies of its later versions reuse each other's subtrees
+
+        The state only reuses the subtrees by their content, it is shared by any number of files.
+        """
+        xmind_file, source_file = os.path.abspath(xmind_file), os.path.abspath(source_file)
+
+        with self._lock:
+            self._sources.pop(xmind_file, None)
+            self._sources[xmind_file] = self._sources.get(source_file, source_file)
+
+            while len(self._sources) > 64 * self.max_files:
+                self._sources.popitem(last=False)
+
+    def state_of(self, xmind_file, options=None):
+        """The `IncrementalState` of a XMind file (or its source, see `set_source`), a new one when the file
+        was not converted yet, None when its content is larger than max_size
+
+        :param xmind_file: the XMind file, or an opened `xmindparser.XmindDocument`
+        """
+        with xmindparser.open_xmind_document(xmind_file) as document:
+            xmind_file, size = document.file_path, content_size_of(document)
+        signature = options_signature(options)
+
+        with self._lock:
+            key = self._sources.get(xmind_file, xmind_file), signature
+            state = self._states.pop(key, None)
+
+            if state is not None:
+                self.size -= state.size
+
+            if size > self.max_size:
+                return None
+
+            state = state or IncrementalState()
+            state.size = size
+            self._states[key] = state
+            self.size += size
+
+            while len(self._states) > self.max_files or self.size > self.max_size:
+                _, old_state = self._states.popitem(last=False)
+                self.size -= old_state.size
+
+        return state
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            self._sources.clear()
+            self.size = 0
+
+    def statistics(self):
+        states = list(self._states.values())
+        return {'files': len(states), 'max_files': self.max_files, 'size': self.size, 'max_size': self.max_size,
+                'hits': sum(s.subtrees.hits for s in states), 'misses': sum(s.subtrees.misses for s in states)}
+
+
+def enable_memory_cache(max_size=64 * 1024 * 1024):
+    """Keep the parsed testsuites of unchanged XMind files in memory, within the memory budget in bytes"""
+    global memory_cache
+    memory_cache = MemoryCache(max_size)
+    return memory_cache
+
+
+def disable_memory_cache():
+    global memory_cache
+    memory_cache = None
+
+
+def enable_disk_cache(folder, max_size=64 * 1024 * 1024):
+    """Cache the parsed testsuites of XMind files in the folder, `get_xmind_testsuites` will load them on a hit"""
+    global disk_cache
+    disk_cache = DiskCache(folder, max_size)
+    return disk_cache
+
+
+def disable_disk_cache():
+    global disk_cache
+    disk_cache = None
+
+
+def enable_incremental_cache(max_files=16, max_size=16 * 1024 * 1024):
+    """Keep the last conversion of XMind files, the subtrees unchanged since then are not parsed nor rendered again,
+    within the budget of their content size in bytes"""
+    global incremental_cache
+    incremental_cache = IncrementalCache(max_files, max_size)
+    return incremental_cache
+
+
+def disable_incremental_cache():
+    global incremental_cache
+    incremental_cache = None
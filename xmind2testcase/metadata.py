@@ -7,6 +7,7 @@ testlink.testlink
 
 
 class TestSuite(object):
+    __slots__ = ('name', 'details', 'testcase_list', 'sub_suites', 'statistics')
 
     def __init__(self, name='', details='', testcase_list=None, sub_suites=None, statistics=None):
         """
@@ -44,8 +45,16 @@ class TestSuite(object):
 
         return data
 
+    @classmethod
+    def from_dict(cls, data):
+        """rebuild a testsuite from the data of `to_dict`"""
+        return cls(data['name'], data['details'], [TestCase.from_dict(case) for case in data['testcase_list']],
+                   [cls.from_dict(suite) for suite in data['sub_suites']], data.get('statistics'))
+
 
 class TestCase(object):
+    __slots__ = ('name', 'version', 'summary', 'preconditions', 'execution_type', 'importance',
+                 'estimated_exec_duration', 'status', 'result', 'steps')
 
     def __init__(self, name='', version=1, summary='', preconditions='', execution_type=1, importance=2, estimated_exec_duration=3, status=7, result=0, steps=None):
         """
@@ -92,8 +101,14 @@ class TestCase(object):
 
         return data
 
+    @classmethod
+    def from_dict(cls, data):
+        """rebuild a testcase from the data of `to_dict`"""
+        return cls(**dict(data, steps=[TestStep.from_dict(step) for step in data['steps']]))
+
 
 class TestStep(object):
+    __slots__ = ('step_number', 'actions', 'expectedresults', 'execution_type', 'result')
 
     def __init__(self, step_number=1, actions='', expectedresults='', execution_type=1, result=0):
         """
@@ -121,3 +136,7 @@ class TestStep(object):
 
         return data
 
+    @classmethod
+    def from_dict(cls, data):
+        """rebuild a test step from the data of `to_dict`"""
+        return cls(**data)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import xmindparser
+from xmind2testcase.parser import ConversionOptions, sheet_to_suite, sub_topics_of
+
+"""
+Parse big XMind files in worker processes, each one reads and parses a part of the first-level testsuites
+"""
+
+
+class ParallelParsing(object):
+
+    def __init__(self, max_workers=None, min_size=8 * 1024 * 1024):
+        """
+        ParallelParsing
+        :param max_workers: the number of worker processes, the number of CPUs by default
+        :param min_size: the smallest content (content.xml or content.json, uncompressed) in bytes to parse in parallel,
+                         smaller XMind files are parsed serially as starting the workers would take longer
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_size = min_size
+
+    def is_worth(self, document):
+        """Whether an opened `xmindparser.XmindDocument` is big enough to be parsed in parallel"""
+        name = 'content.json' if document.is_zen else 'content.xml'
+        return self.max_workers > 1 and name in document and document.size_of(name) >= self.min_size
+
+    def parse(self, xmind_file, sheets=None, options=None):
+        """Parse the XMind file to `xmind2testcase.metadata.TestSuite` list like `xmind2testcase.utils.parse_xmind_testsuites`
+
+        The first-level testsuites of all the sheets are numbered in order and dealt to the workers in turn,
+        so both a map with many sheets and a sheet with many testsuites are spread over the workers.
+        The sub testsuites are merged back in their original order.
+        """
+        options = options or ConversionOptions()  # the workers may not share `parser.config`
+        parts = self.max_workers
+
+        with ProcessPoolExecutor(parts) as executor:
+            futures = [executor.submit(parse_main_topics, xmind_file, sheets, options, dict(xmindparser.config),
+                                       part, parts) for part in range(parts)]
+            results = [future.result() for future in futures]
+
+        if not results[0]:
+            logging.error('Invalid XMind file(%s): it is empty!', xmind_file)
+            return []
+
+        testsuites = []
+
+        for sheet_results in zip(*results):
+            # only the workers which got any first-level topic of the sheet parsed it
+            suites = [suite for _, suite, has_main_topics, _ in sheet_results if has_main_topics]
+
+            if not suites:
+                logging.warning('This is a blank sheet(%s), should have at least 1 sub topic(test suite)',
+                                sheet_results[0][0])
+                continue
+
+            suite = suites[0]
+
+            sub_suites = sorted((s for _, _, _, sub_suites in sheet_results for s in sub_suites), key=itemgetter(0))
+            suite.sub_suites = [sub_suite for _, sub_suite in sub_suites]
+            testsuites.append(suite)
+
+        return testsuites
+
+
+def parse_main_topics(xmind_file, sheets, options, xmindparser_config, part, parts):
+    """Parse the first-level testsuites numbered part, part + parts, part + 2 * parts... of the XMind file, in a worker
+
+    :return: (sheet title, testsuite without sub testsuites, if the sheet has any first-level topic of this part,
+             [(number, sub testsuite)]) of each sheet, the testsuite is None without any first-level topic
+    """
+    xmindparser.config.update(xmindparser_config)  # a spawned worker doesn't see the changes made in the parent
+    results = []
+    number = part
+
+    for sheet in xmindparser.iter_xmind_data(xmind_file, compact=True, sheets=sheets,
+                                             main_topics=lambda n: n % parts == part):
+        root_topic = sheet['topic']
+        main_topics = root_topic.get('topics', [])
+        numbers = {}
+
+        for topic in main_topics:
+            numbers[topic] = number
+            number += parts
+
+        if not main_topics:
+            # a blank sheet isn't parsed, like `xmind2testcase.parser.iter_testcases` does
+            results.append((sheet['title'], None, False, []))
+            continue
+
+        suite = sheet_to_suite(root_topic, options)
+        sub_suites = [(numbers[topic], sub_suite) for topic, sub_suite in zip(sub_topics_of(root_topic, options),
+                                                                                suite.sub_suites)]
+        suite.sub_suites = []
+        results.append((sheet['title'], suite, bool(main_topics), sub_suites))
+
+    return results
+
+
+# the enabled `ParallelParsing`, see `enable_parallel_parsing`
+parallel_parsing = None
+
+
+def enable_parallel_parsing(max_workers=None, min_size=8 * 1024 * 1024):
+    """Parse the XMind files whose content is at least min_size bytes in worker processes"""
+    global parallel_parsing
+    parallel_parsing = ParallelParsing(max_workers, min_size)
+    return parallel_parsing
+
+
+def disable_parallel_parsing():
+    global parallel_parsing
+    parallel_parsing = None
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 # _*_ coding:utf-8 _*_
 
+import copy
 import logging
+from collections import namedtuple
 from xmind2testcase.metadata import TestSuite, TestCase, TestStep
 
 config = {'sep': ' ',
@@ -12,139 +14,321 @@ config = {'sep': ' ',
           }
 
 
-def xmind_to_testsuites(xmind_content_dict):
-    """convert xmind file to `xmind2testcase.metadata.TestSuite` list"""
+class ConversionOptions(object):
+
+    def __init__(self, sep=None, valid_sep=None, precondition_sep=None, summary_sep=None, ignore_char=None):
+        """
+        ConversionOptions, the options of one conversion, each option left None is taken from `config`
+        :param sep: the separator connecting the titles of a testcase, unless its sheet's root title ends with
+                    a valid separator, which `sheet_to_suite` takes instead
+        :param valid_sep: the characters which can be the separator at the end of a sheet's root title
+        :param precondition_sep: the separator connecting the notes (preconditions) of a testcase
+        :param summary_sep: the separator connecting the comments (summary) of a testcase
+        :param ignore_char: a topic or element starting with any of these characters is ignored
+        """
+        self.sep = config['sep'] if sep is None else sep
+        self.valid_sep = config['valid_sep'] if valid_sep is None else valid_sep
+        self.precondition_sep = config['precondition_sep'] if precondition_sep is None else precondition_sep
+        self.summary_sep = config['summary_sep'] if summary_sep is None else summary_sep
+        self.ignore_char = config['ignore_char'] if ignore_char is None else ignore_char
+
+    def replace(self, **changes):
+        """A copy of the options with some of them changed, the options themselves are never modified"""
+        options = copy.copy(self)
+        for name, value in changes.items():
+            if not hasattr(options, name):
+                raise TypeError('Unknown conversion option: {}'.format(name))
+            setattr(options, name, value)
+        return options
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        return 'ConversionOptions({})'.format(', '.join('{}={!r}'.format(k, v) for k, v in vars(self).items()))
+
+
+def xmind_to_testsuites(xmind_content_dict, options=None, reuse=None):
+    """convert xmind file to `xmind2testcase.metadata.TestSuite` list
+
+    The blank or ignored topics are skipped while parsing, the xmind content is not modified,
+    so it can be parsed again or shared with other consumers.
+
+    :param options: the `ConversionOptions` of this conversion, the options from `config` by default.
+                    Neither the options nor `config` are modified, conversions can run in parallel threads.
+    :param reuse: a `xmindparser.SubtreeCache` of the sub testsuites by their topics, kept from the last conversion.
+                  The topics reused by `xmindparser.xmind_to_data(subtrees=...)` are not parsed again.
+    """
     suites = []
 
+    for _ in iter_testcases(xmind_content_dict, options, suites, reuse):
+        pass
+
+    return suites
+
+
+def iter_testcases(xmind_content_dict, options=None, suites=None, reuse=None):
+    """yield (testsuite, sub testsuite, testcase) of each testcase as soon as it is parsed
+
+    The testsuites are filled in while parsing, each one is appended to `suites` when its sheet starts,
+    so `suites` is the same as `xmind_to_testsuites` once the generator ends.
+    The sheets of `xmind_content_dict` are taken one by one, it can be a generator like `xmindparser.iter_xmind_data`.
+    """
+    options = options or ConversionOptions()
+
     for sheet in xmind_content_dict:
         logging.debug('start to parse a sheet: %s', sheet['title'])
         root_topic = sheet['topic']
         sub_topics = root_topic.get('topics', [])
 
-        if sub_topics:
-            root_topic['topics'] = filter_empty_or_ignore_topic(sub_topics)
-        else:
+        if not sub_topics:
             logging.warning('This is a blank sheet(%s), should have at least 1 sub topic(test suite)', sheet['title'])
             continue
-        suite = sheet_to_suite(root_topic)
+        suite = TestSuite()
         # suite.sheet_name = sheet['title']  # root testsuite has a sheet_name attribute
-        logging.debug('sheet(%s) parsing complete: %s', sheet['title'], suite.to_dict())
-        suites.append(suite)
+        if suites is not None:
+            suites.append(suite)
 
-    return suites
+        for sub_suite, case in iter_suite_testcases(suite, root_topic, options, reuse):
+            yield suite, sub_suite, case
 
+        if logging.root.isEnabledFor(logging.DEBUG):  # to_dict() serializes the whole suite, only do it for debugging
+            logging.debug('sheet(%s) parsing complete: %s', sheet['title'], suite.to_dict())
 
-def filter_empty_or_ignore_topic(topics):
-    """filter blank or start with config.ignore_char topic"""
-    result = [topic for topic in topics if not(
-            topic['title'] is None or
-            topic['title'].strip() == '' or
-            topic['title'][0] in config['ignore_char'])]
 
-    for topic in result:
-        sub_topics = topic.get('topics', [])
-        topic['topics'] = filter_empty_or_ignore_topic(sub_topics)
+def filter_empty_or_ignore_topic(topics, options=None):
+    """filter blank or start with options.ignore_char topic, the sub topics are walked without recursion
+
+    The `topics` of each topic are replaced with the filtered ones, `sub_topics_of` filters without modifying them.
+    """
+    options = options or ConversionOptions()
+    result = _filter_topics(topics, options)
+    stack = list(result)
+
+    while stack:
+        topic = stack.pop()
+        topic['topics'] = _filter_topics(topic.get('topics', []), options)
+        stack.extend(topic['topics'])
 
     return result
 
 
-def filter_empty_or_ignore_element(values):
+def sub_topics_of(topic, options=None):
+    """The sub topics of a topic which are not blank or start with options.ignore_char, the topic is not modified"""
+    return _filter_topics(topic.get('topics', []), options or ConversionOptions())
+
+
+def _filter_topics(topics, options):
+    return [topic for topic in topics if not(
+            topic['title'] is None or
+            topic['title'].strip() == '' or
+            topic['title'][0] in options.ignore_char)]
+
+
+def filter_empty_or_ignore_element(values, options=None):
     """Filter all empty or ignore XMind elements, especially notes、comments、labels element"""
+    ignore_char = (options or ConversionOptions()).ignore_char
     result = []
     for value in values:
-        if isinstance(value, str) and not value.strip() == '' and not value[0] in config['ignore_char']:
+        if isinstance(value, str) and not value.strip() == '' and not value[0] in ignore_char:
             result.append(value.strip())
     return result
 
 
-def sheet_to_suite(root_topic):
+def sheet_to_suite(root_topic, options=None):
     """convert a xmind sheet to a `TestSuite` instance"""
     suite = TestSuite()
+
+    for _ in iter_suite_testcases(suite, root_topic, options):
+        pass
+
+    return suite
+
+
+def iter_suite_testcases(suite, root_topic, options=None, reuse=None):
+    """fill a xmind sheet in the `TestSuite` while parsing, yield (sub testsuite, testcase) of each testcase
+
+    A valid separator at the end of the root title is only set on a copy of the options for this sheet,
+    the testcase titles of a sheet without one are joined by `options.sep`.
+    A sub testsuite found in `reuse` by its topic and the options is taken as is instead of parsing the topic.
+    """
+    options = options or ConversionOptions()
     root_title = root_topic['title']
     separator = root_title[-1]
 
-    if separator in config['valid_sep']:
+    if separator in options.valid_sep:
         logging.debug('find a valid separator for connecting testcase title: %s', separator)
-        config['sep'] = separator  # set the separator for the testcase's title
+        options = options.replace(sep=separator)  # set the separator for the testcase's title
         root_title = root_title[:-1]
-    else:
-        config['sep'] = ' '
 
     suite.name = root_title
     suite.details = root_topic['note']
     suite.sub_suites = []
 
-    for suite_dict in root_topic['topics']:
-        suite.sub_suites.append(parse_testsuite(suite_dict))
+    signature = repr(options) if reuse is not None else None
 
-    return suite
+    for suite_dict in sub_topics_of(root_topic, options):
+        testsuite = reuse.get((suite_dict, signature)) if reuse is not None else None
 
+        if testsuite is not None:
+            suite.sub_suites.append(testsuite)
+            for case in testsuite.testcase_list:
+                yield testsuite, case
+            continue
+
+        testsuite = TestSuite()
+        suite.sub_suites.append(testsuite)
+
+        for case in iter_testsuite_testcases(testsuite, suite_dict, options):
+            yield testsuite, case
 
-def parse_testsuite(suite_dict):
+        if reuse is not None:
+            reuse.set((suite_dict, signature), testsuite)
+
+
+def parse_testsuite(suite_dict, options=None):
     testsuite = TestSuite()
+
+    for _ in iter_testsuite_testcases(testsuite, suite_dict, options):
+        pass
+
+    return testsuite
+
+
+def iter_testsuite_testcases(testsuite, suite_dict, options=None):
+    """fill a testsuite topic in the `TestSuite` while parsing, yield each testcase once it is parsed"""
+    options = options or ConversionOptions()
     testsuite.name = suite_dict['title']
     testsuite.details = suite_dict['note']
     testsuite.testcase_list = []
     logging.debug('start to parse a testsuite: %s', testsuite.name)
 
-    for cases_dict in suite_dict.get('topics', []):
-        for case in recurse_parse_testcase(cases_dict):
+    for cases_dict in sub_topics_of(suite_dict, options):
+        for case in recurse_parse_testcase(cases_dict, options=options):
             testsuite.testcase_list.append(case)
+            yield case
+
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug('testsuite(%s) parsing complete: %s', testsuite.name, testsuite.to_dict())
+
+
+def recurse_parse_testcase(case_dict, parent=None, options=None):
+    """yield the testcases under a topic, walking the topic tree with an explicit stack instead of recursion
+
+    The title, preconditions, summary and execution type of the ancestors are carried down the tree
+    as prefixes, so each testcase only adds its own topic to them instead of going through all ancestors.
+    """
+    options = options or ConversionOptions()
+    prefixes = [gen_testcase_prefix(parent or [], options)]
+    stack = [(case_dict, 0)]
+
+    while stack:
+        case_dict, depth = stack.pop()
+        del prefixes[depth + 1:]  # drop the ancestors of the previous topic
+        prefix = add_to_testcase_prefix(prefixes[depth], case_dict, options)
+        children = sub_topics_of(case_dict, options)
+
+        marker_info = marker_info_of(case_dict['markers'])
+
+        if is_testcase_topic(case_dict, children, options, marker_info):
+            yield parse_a_testcase_with_prefix(case_dict, prefix, children, options, marker_info)
+        else:
+            prefixes.append(prefix)
+
+            for child_dict in reversed(children):
+                stack.append((child_dict, depth + 1))
+
+
+def gen_testcase_prefix(topics, options=None):
+    """Gen the (title, preconditions, summary, execution type) prefix of the testcases below the topics"""
+    options = options or ConversionOptions()
+    prefix = ('', '', '', 1)
+
+    for topic in topics:
+        prefix = add_to_testcase_prefix(prefix, topic, options)
+
+    return prefix
 
-    logging.debug('testsuite(%s) parsing complete: %s', testsuite.name, testsuite.to_dict())
-    return testsuite
 
+def add_to_testcase_prefix(prefix, topic, options=None):
+    """Add a topic to the prefix of its parent, the same as `gen_testcase_title`, `gen_testcase_preconditions`,
+    `gen_testcase_summary` and `get_execution_type` with the topic appended to the topics"""
+    options = options or ConversionOptions()
+    title, preconditions, summary, exe_type = prefix
 
-def recurse_parse_testcase(case_dict, parent=None):
-    if is_testcase_topic(case_dict):
-        case = parse_a_testcase(case_dict, parent)
-        yield case
-    else:
-        if not parent:
-            parent = []
+    # when separator is not blank, will add space around separator, e.g. '/' will be changed to ' / '
+    separator = options.sep
+    if separator != ' ':
+        separator = ' {} '.format(separator)
+
+    title = join_prefix(title, topic['title'], separator, options)
+    preconditions = join_prefix(preconditions, topic['note'], options.precondition_sep, options)
+    summary = join_prefix(summary, topic['comment'], options.summary_sep, options)
 
-        parent.append(case_dict)
+    for item in filter_empty_or_ignore_element([topic.get('label', '')], options):
+        if item.lower() in ['自动', 'auto', 'automate', 'automation']:
+            exe_type = 2
+        elif item.lower() in ['手动', '手工', 'manual']:
+            exe_type = 1
 
-        for child_dict in case_dict.get('topics', []):
-            for case in recurse_parse_testcase(child_dict, parent):
-                yield case
+    return title, preconditions, summary, exe_type
 
-        parent.pop()
 
+def join_prefix(prefix, value, separator, options=None):
+    """Join a topic's value to the prefix, like `separator.join(filter_empty_or_ignore_element(values))`"""
+    values = filter_empty_or_ignore_element([value], options)
 
-def is_testcase_topic(case_dict):
-    """A topic with a priority marker, or no subtopic, indicates that it is a testcase"""
-    priority = get_priority(case_dict)
+    if not values:
+        return prefix
+
+    return prefix + separator + values[0] if prefix else values[0]
+
+
+def is_testcase_topic(case_dict, children=None, options=None, marker_info=None):
+    """A topic with a priority marker, or no subtopic, indicates that it is a testcase
+
+    :param children: the sub topics from `sub_topics_of(case_dict)` if they are already filtered
+    :param marker_info: the `MarkerInfo` of the topic's markers if it is already resolved
+    """
+    priority = (marker_info or marker_info_of(case_dict['markers'])).priority
     if priority:
         return True
 
-    children = case_dict.get('topics', [])
+    if children is None:
+        children = sub_topics_of(case_dict, options)
     if children:
         return False
 
     return True
 
 
-def parse_a_testcase(case_dict, parent):
-    testcase = TestCase()
+def parse_a_testcase(case_dict, parent, options=None):
     topics = parent + [case_dict] if parent else [case_dict]
+    return parse_a_testcase_with_prefix(case_dict, gen_testcase_prefix(topics, options), options=options)
 
-    testcase.name = gen_testcase_title(topics)
 
-    preconditions = gen_testcase_preconditions(topics)
-    testcase.preconditions = preconditions if preconditions else '无'
+def parse_a_testcase_with_prefix(case_dict, prefix, children=None, options=None, marker_info=None):
+    """Parse a testcase topic with the prefix of its topics from `gen_testcase_prefix`, itself included
 
-    summary = gen_testcase_summary(topics)
+    :param children: the sub topics (test steps) from `sub_topics_of(case_dict)` if they are already filtered
+    :param marker_info: the `MarkerInfo` of the topic's markers if it is already resolved
+    """
+    marker_info = marker_info or marker_info_of(case_dict['markers'])
+    testcase = TestCase()
+    title, preconditions, summary, exe_type = prefix
+
+    testcase.name = title
+    testcase.preconditions = preconditions if preconditions else '无'
     testcase.summary = summary if summary else testcase.name
-    testcase.execution_type = get_execution_type(topics)
-    testcase.importance = get_priority(case_dict) or 2
+    testcase.execution_type = exe_type
+    testcase.importance = marker_info.priority or 2
 
-    step_dict_list = case_dict.get('topics', [])
+    step_dict_list = sub_topics_of(case_dict, options) if children is None else children
     if step_dict_list:
-        testcase.steps = parse_test_steps(step_dict_list)
+        testcase.steps = parse_test_steps(step_dict_list, options)
 
     # the result of the testcase take precedence over the result of the teststep
-    testcase.result = get_test_result(case_dict['markers'])
+    testcase.result = marker_info.result
 
     if testcase.result == 0 and testcase.steps:
         for step in testcase.steps:
@@ -157,13 +341,14 @@ def parse_a_testcase(case_dict, parent):
 
             testcase.result = step.result  # there is no need to judge where test step are ignored
 
-    logging.debug('finds a testcase: %s', testcase.to_dict())
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug('finds a testcase: %s', testcase.to_dict())
     return testcase
 
 
-def get_execution_type(topics):
+def get_execution_type(topics, options=None):
     labels = [topic.get('label', '') for topic in topics]
-    labels = filter_empty_or_ignore_element(labels)
+    labels = filter_empty_or_ignore_element(labels, options)
     exe_type = 1
     for item in labels[::-1]:
         if item.lower() in ['自动', 'auto', 'automate', 'automation']:
@@ -177,53 +362,123 @@ def get_execution_type(topics):
 
 def get_priority(case_dict):
     """Get the topic's priority（equivalent to the importance of the testcase)"""
-    if isinstance(case_dict['markers'], list):
-        for marker in case_dict['markers']:
-            if marker.startswith('priority'):
-                return int(marker[-1])
+    return marker_info_of(case_dict['markers']).priority
+
+
+# the markers of a topic resolved at once: priority of the first priority marker or None,
+# test result (see `get_test_result`), task progress in eighths of the first task marker or None, flag colors
+MarkerInfo = namedtuple('MarkerInfo', ['priority', 'result', 'progress', 'flags'])
+
+_no_markers = MarkerInfo(None, 0, None, ())
+
+# the symbol-* and custom c_simbol-* markers of a test result, the lowest result wins when a topic has several
+_symbol_results = {'right': 1, 'wrong': 2, 'pause': 3, 'minus': 4}
+
+_task_progress = {'start': 0, 'oct': 1, 'quarter': 2, '3oct': 3, 'half': 4, '5oct': 5, '3quar': 6, '7oct': 7, 'done': 8}
+
+# marker id -> (priority, result, progress, flag) of a single marker, each id is only classified once
+marker_table = {}
+
+# markers of a topic -> `MarkerInfo`, the same few marker combinations are used all over a map
+_marker_infos = {}
+_max_marker_infos = 4096
+
+
+def classify_marker(marker):
+    """The (priority, result, task progress, flag color) of a single marker id, None or 0 when it is not one"""
+    family, _, name = marker.partition('-')
+    priority = int(marker[-1]) if marker.startswith('priority') and marker[-1].isdigit() else None
+    result = _symbol_results.get(name, 0) if family in ('symbol', 'c_simbol') else 0
+    progress = _task_progress.get(name) if family == 'task' else None
+    flag = name if family == 'flag' and name else None
+    return priority, result, progress, flag
 
 
-def gen_testcase_title(topics):
+def marker_info_of(markers):
+    """Resolve the markers of a topic to a `MarkerInfo` through the precomputed tables"""
+    if not markers or not isinstance(markers, (list, tuple)):
+        return _no_markers
+
+    key = tuple(markers) if isinstance(markers, list) else markers
+    info = _marker_infos.get(key)
+
+    if info is None:
+        if len(_marker_infos) >= _max_marker_infos:
+            _marker_infos.clear()
+        info = _marker_infos[key] = _resolve_markers(key)
+
+    return info
+
+
+def _resolve_markers(markers):
+    priority, result, progress, flags = None, 0, None, []
+
+    for marker in markers:
+        if not isinstance(marker, str):
+            continue
+
+        classified = marker_table.get(marker)
+        if classified is None:
+            classified = marker_table[marker] = classify_marker(marker)
+
+        marker_priority, marker_result, marker_progress, flag = classified
+
+        if priority is None:
+            priority = marker_priority
+        if marker_result and (not result or marker_result < result):
+            result = marker_result
+        if progress is None:
+            progress = marker_progress
+        if flag:
+            flags.append(flag)
+
+    return MarkerInfo(priority, result, progress, tuple(flags))
+
+
+def gen_testcase_title(topics, options=None):
     """Link all topic's title as testcase title"""
+    options = options or ConversionOptions()
     titles = [topic['title'] for topic in topics]
-    titles = filter_empty_or_ignore_element(titles)
+    titles = filter_empty_or_ignore_element(titles, options)
 
     # when separator is not blank, will add space around separator, e.g. '/' will be changed to ' / '
-    separator = config['sep']
+    separator = options.sep
     if separator != ' ':
         separator = ' {} '.format(separator)
 
     return separator.join(titles)
 
 
-def gen_testcase_preconditions(topics):
+def gen_testcase_preconditions(topics, options=None):
+    options = options or ConversionOptions()
     notes = [topic['note'] for topic in topics]
-    notes = filter_empty_or_ignore_element(notes)
-    return config['precondition_sep'].join(notes)
+    notes = filter_empty_or_ignore_element(notes, options)
+    return options.precondition_sep.join(notes)
 
 
-def gen_testcase_summary(topics):
+def gen_testcase_summary(topics, options=None):
+    options = options or ConversionOptions()
     comments = [topic['comment'] for topic in topics]
-    comments = filter_empty_or_ignore_element(comments)
-    return config['summary_sep'].join(comments)
+    comments = filter_empty_or_ignore_element(comments, options)
+    return options.summary_sep.join(comments)
 
 
-def parse_test_steps(step_dict_list):
+def parse_test_steps(step_dict_list, options=None):
     steps = []
 
     for step_num, step_dict in enumerate(step_dict_list, 1):
-        test_step = parse_a_test_step(step_dict)
+        test_step = parse_a_test_step(step_dict, options)
         test_step.step_number = step_num
         steps.append(test_step)
 
     return steps
 
 
-def parse_a_test_step(step_dict):
+def parse_a_test_step(step_dict, options=None):
     test_step = TestStep()
     test_step.actions = step_dict['title']
 
-    expected_topics = step_dict.get('topics', [])
+    expected_topics = sub_topics_of(step_dict, options)
     if expected_topics:  # have expected result
         expected_topic = expected_topics[0]
         test_step.expectedresults = expected_topic['title']  # one test step action, one test expected result
@@ -233,32 +488,11 @@ def parse_a_test_step(step_dict):
         markers = step_dict['markers']
         test_step.result = get_test_result(markers)
 
-    logging.debug('finds a teststep: %s', test_step.to_dict())
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug('finds a teststep: %s', test_step.to_dict())
     return test_step
 
 
 def get_test_result(markers):
     """test result: non-execution:0, pass:1, failed:2, blocked:3, skipped:4"""
-    if isinstance(markers, list):
-        if 'symbol-right' in markers or 'c_simbol-right' in markers:
-            result = 1
-        elif 'symbol-wrong' in markers or 'c_simbol-wrong' in markers:
-            result = 2
-        elif 'symbol-pause' in markers or 'c_simbol-pause' in markers:
-            result = 3
-        elif 'symbol-minus' in markers or 'c_simbol-minus' in markers:
-            result = 4
-        else:
-            result = 0
-    else:
-        result = 0
-
-    return result
-
-
-
-
-
-
-
-
+    return marker_info_of(markers).result
@@ -2,12 +2,15 @@
 # _*_ coding:utf-8 _*_
 import logging
 import os
+import re
 from io import BytesIO
-from xml.dom import minidom
+from itertools import islice
 from xml.sax.saxutils import escape
+from xmindparser import open_xmind_document
+from xmindparser.xmlwriter import escape_text, escape_xml, invalid_xml_chars
 from xmind2testcase import const
-from xmind2testcase.parser import config
-from xmind2testcase.utils import get_xmind_testsuites, get_absolute_path
+from xmind2testcase.parser import ConversionOptions
+from xmind2testcase.utils import iter_xmind_testsuites, replacing_file
 from xml.etree.ElementTree import Element, SubElement, ElementTree, Comment
 
 """
@@ -15,31 +18,187 @@ Convert XMind fie to TestLink testcase xml file
 """
 
 
-def xmind_to_testlink_xml_file(xmind_file, is_all_sheet=True):
-    """Convert a XMind sheet to a testlink xml file"""
-    xmind_file = get_absolute_path(xmind_file)
-    logging.info('Start converting XMind file(%s) to testlink file...', xmind_file)
-    testsuites = get_xmind_testsuites(xmind_file)
-    if not is_all_sheet and testsuites:
-        testsuites = [testsuites[0]]
+def xmind_to_testlink_xml_file(xmind_file, is_all_sheet=True, options=None):
+    """Convert a XMind sheet to a testlink xml file, each testsuite is written as soon as its sheet is parsed
 
-    xml_content = testsuites_to_xml_content(testsuites)
-    testlink_xml_file = xmind_file[:-6] + '.xml'
+    The xml is written to a temporary file next to the xml file, which becomes the xml file once complete,
+    so a failed conversion never leaves a partial xml file.
 
-    if os.path.exists(testlink_xml_file):
-        logging.info('the testlink xml file already exists, return it directly: %s', testlink_xml_file)
-        return testlink_xml_file
+    :param options: the `xmind2testcase.parser.ConversionOptions` of this conversion
+    """
+    options = options or ConversionOptions()
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+        testlink_xml_file = xmind_file[:-6] + '.xml'
 
-    with open(testlink_xml_file, 'w', encoding='utf-8') as f:
-        pretty_content = minidom.parseString(xml_content).toprettyxml(indent='\t')
-        f.write(pretty_content)
-        logging.info('convert XMind file(%s) to a testlink xml file(%s) successfully!', xmind_file, testlink_xml_file)
+        if os.path.exists(testlink_xml_file):
+            logging.info('the testlink xml file already exists, return it directly: %s', testlink_xml_file)
+            return testlink_xml_file
 
+        logging.info('Start converting XMind file(%s) to testlink file...', xmind_file)
+        if is_all_sheet:
+            testsuites = iter_xmind_testsuites(document, options=options)
+        else:
+            # only the first sheet is parsed, unless it is blank and the first testsuite is in a later sheet
+            testsuites = list(iter_xmind_testsuites(document, 0, options)) or \
+                islice(iter_xmind_testsuites(document, options=options), 1)
+
+        with replacing_file(testlink_xml_file) as temp_file, open(temp_file, 'w', encoding='utf-8') as f:
+            write_testsuites_xml(testsuites, f, options)
+
+    logging.info('convert XMind file(%s) to a testlink xml file(%s) successfully!', xmind_file, testlink_xml_file)
     return testlink_xml_file
 
 
-def testsuites_to_xml_content(testsuites):
+def write_testsuites_xml(testsuites, f, options=None):
+    """Write the testsuites to a text file in testlink xml file format, one by one as they are taken
+
+    The same text as `minidom.parseString(testsuites_to_xml_content(testsuites)).toprettyxml(indent='\t')`,
+    without building nor parsing the whole document.
+    """
+    options = options or ConversionOptions()
+    writer = XmlWriter(f)
+    f.write('<?xml version="1.0" ?>\n')
+    writer.start(const.TAG_TESTSUITE)
+
+    for testsuite in testsuites:
+        writer.start(const.TAG_TESTSUITE, testsuite.name)
+        write_text_element(writer, const.TAG_DETAILS, testsuite.details, options)
+
+        for sub_suite in testsuite.sub_suites:
+            if is_should_skip(sub_suite.name, options):
+                continue
+            writer.start(const.TAG_TESTSUITE, sub_suite.name)
+            write_text_element(writer, const.TAG_DETAILS, sub_suite.details, options)
+            write_testcase_elements(writer, sub_suite, options)
+            writer.end()
+
+        writer.end()
+
+    writer.end()
+
+
+def write_testcase_elements(writer, suite, options=None):
+    """Write the testcase elements of a sub testsuite like `gen_testcase_element`"""
+    for testcase in suite.testcase_list:
+
+        if is_should_skip(testcase.name, options):
+            continue
+
+        writer.start(const.TAG_TESTCASE, testcase.name)
+        write_text_element(writer, const.TAG_VERSION, str(testcase.version), options)
+        write_text_element(writer, const.TAG_SUMMARY, testcase.summary, options)
+        write_text_element(writer, const.TAG_PRECONDITIONS, testcase.preconditions, options)
+        write_text_element(writer, const.TAG_EXECUTION_TYPE, _convert_execution_type(testcase.execution_type), options)
+        write_text_element(writer, const.TAG_IMPORTANCE, _convert_importance(testcase.importance), options)
+        writer.text(const.TAG_ESTIMATED_EXEC_DURATION, str(testcase.estimated_exec_duration))
+        writer.text(const.TAG_STATUS, str(testcase.status) if testcase.status in (1, 2, 3, 4, 5, 6, 7) else '7')
+
+        if testcase.steps:
+            writer.start(const.TAG_STEPS)
+
+            for step in testcase.steps:
+
+                if is_should_skip(step.actions, options):
+                    continue
+
+                writer.start(const.TAG_STEP)
+                write_text_element(writer, const.TAG_STEP_NUMBER, str(step.step_number), options)
+                write_text_element(writer, const.TAG_ACTIONS, step.actions, options)
+                write_text_element(writer, const.TAG_EXPECTEDRESULTS, step.expectedresults, options)
+                write_text_element(writer, const.TAG_EXECUTION_TYPE, _convert_execution_type(step.execution_type), options)
+                writer.end()
+
+            writer.end()
+
+        writer.end()
+
+
+def write_text_element(writer, tag_name, content, options=None):
+    """write an element's text conent like `gen_text_element`: <![CDATA[text]]>"""
+    if is_should_parse(content, options):
+        writer.cdata(tag_name, _cdata_content(content))
+
+
+class XmlWriter(object):
+    """Write xml elements to a text file one by one, indented by tabs like `xml.dom.minidom` `toprettyxml(indent='\t')`
+
+    A start tag is left open until the first child or the end of its element, as an element without children
+    is closed in its start tag: <tag/>.
+    """
+
+    def __init__(self, f):
+        self._write = f.write
+        self._elements = []  # [tag, if it has children] of the open elements
+
+    def start(self, tag, name=None):
+        """start an element with an optional name attribute"""
+        indent = self._add_child()
+
+        if name is None:
+            self._write('{}<{}'.format(indent, tag))
+        else:
+            self._write('{}<{} {}="{}"'.format(indent, tag, const.ATTR_NMAE, escape_xml(name)))
+        self._elements.append([tag, False])
+
+    def end(self):
+        tag, has_children = self._elements.pop()
+
+        if has_children:
+            self._write('{}</{}>\n'.format('\t' * len(self._elements), tag))
+        else:
+            self._write('/>\n')
+
+    def text(self, tag, text):
+        """write an element with a text"""
+        indent = self._add_child()
+        text = escape_text(text)
+
+        if text:
+            self._write('{0}<{1}>{2}</{1}>\n'.format(indent, tag, text))
+        else:
+            self._write('{}<{}/>\n'.format(indent, tag))
+
+    def cdata(self, tag, content):
+        """write an element with a CDATA section, surrounded by the empty comments `element_set_text` leaves"""
+        indent = self._add_child()
+
+        if invalid_xml_chars.search(content):
+            # a lone surrogate was encoded as a character reference, which is kept as text in a CDATA section
+            content = re.sub('[\ud800-\udfff]', lambda m: '&#{};'.format(ord(m.group())), content)
+
+            if invalid_xml_chars.search(content):
+                raise ValueError('Invalid character in the testlink xml: {!r}'.format(content))
+
+        content = content.replace('\r\n', '\n').replace('\r', '\n').replace(']]>', ']]]]><![CDATA[>')
+        self._write('{0}<{1}>\n{0}\t<!-- -->\n<![CDATA[{2}]]>{0}\t \n{0}\t<!-- -->\n{0}</{1}>\n'.format(
+            indent, tag, content))
+
+    def _add_child(self):
+        """complete the start tag of the parent before its first child, return the indent of the child"""
+        if self._elements:
+            parent = self._elements[-1]
+
+            if not parent[1]:
+                self._write('>\n')
+                parent[1] = True
+
+        return '\t' * len(self._elements)
+
+
+def _cdata_content(content):
+    # retain html tags in content
+    content = escape(content, entities={'\r\n': '<br />'})
+    # replace new line for *nix system
+    content = content.replace('\n', '<br />')
+    # add the line break in source to make it readable
+    content = content.replace('<br />', '<br />\n')
+    return content
+
+
+def testsuites_to_xml_content(testsuites, options=None):
     """Convert the testsuites to testlink xml file format"""
+    options = options or ConversionOptions()
     root_element = Element(const.TAG_TESTSUITE)
     # setting the root suite's name attribute, that will generate a new testsuite folder on testlink
     # root_element.set(const.ATTR_NMAE, testsuite.name)
@@ -47,15 +206,15 @@ def testsuites_to_xml_content(testsuites):
     for testsuite in testsuites:
         suite_element = SubElement(root_element, const.TAG_TESTSUITE)
         suite_element.set(const.ATTR_NMAE, testsuite.name)
-        gen_text_element(suite_element, const.TAG_DETAILS, testsuite.details)
+        gen_text_element(suite_element, const.TAG_DETAILS, testsuite.details, options)
 
         for sub_suite in testsuite.sub_suites:
-            if is_should_skip(sub_suite.name):
+            if is_should_skip(sub_suite.name, options):
                 continue
             sub_suite_element = SubElement(suite_element, const.TAG_TESTSUITE)
             sub_suite_element.set(const.ATTR_NMAE, sub_suite.name)
-            gen_text_element(sub_suite_element, const.TAG_DETAILS, sub_suite.details)
-            gen_testcase_element(sub_suite_element, sub_suite)
+            gen_text_element(sub_suite_element, const.TAG_DETAILS, sub_suite.details, options)
+            gen_testcase_element(sub_suite_element, sub_suite, options)
 
     testlink = ElementTree(root_element)
     content_stream = BytesIO()
@@ -63,20 +222,20 @@ def testsuites_to_xml_content(testsuites):
     return content_stream.getvalue()
 
 
-def gen_testcase_element(suite_element, suite):
+def gen_testcase_element(suite_element, suite, options=None):
     for testcase in suite.testcase_list:
 
-        if is_should_skip(testcase.name):
+        if is_should_skip(testcase.name, options):
             continue
 
         testcase_elment = SubElement(suite_element, const.TAG_TESTCASE)
         testcase_elment.set(const.ATTR_NMAE, testcase.name)
 
-        gen_text_element(testcase_elment, const.TAG_VERSION, str(testcase.version))
-        gen_text_element(testcase_elment, const.TAG_SUMMARY, testcase.summary)
-        gen_text_element(testcase_elment, const.TAG_PRECONDITIONS, testcase.preconditions)
-        gen_text_element(testcase_elment, const.TAG_EXECUTION_TYPE, _convert_execution_type(testcase.execution_type))
-        gen_text_element(testcase_elment, const.TAG_IMPORTANCE, _convert_importance(testcase.importance))
+        gen_text_element(testcase_elment, const.TAG_VERSION, str(testcase.version), options)
+        gen_text_element(testcase_elment, const.TAG_SUMMARY, testcase.summary, options)
+        gen_text_element(testcase_elment, const.TAG_PRECONDITIONS, testcase.preconditions, options)
+        gen_text_element(testcase_elment, const.TAG_EXECUTION_TYPE, _convert_execution_type(testcase.execution_type), options)
+        gen_text_element(testcase_elment, const.TAG_IMPORTANCE, _convert_importance(testcase.importance), options)
 
         estimated_exec_duration_element = SubElement(testcase_elment, const.TAG_ESTIMATED_EXEC_DURATION)
         estimated_exec_duration_element.text = str(testcase.estimated_exec_duration)
@@ -84,55 +243,51 @@ def gen_testcase_element(suite_element, suite):
         status = SubElement(testcase_elment, const.TAG_STATUS)
         status.text = str(testcase.status) if testcase.status in (1, 2, 3, 4, 5, 6, 7) else '7'
 
-        gen_steps_element(testcase_elment, testcase)
+        gen_steps_element(testcase_elment, testcase, options)
 
 
-def gen_steps_element(testcase_element, testcase):
+def gen_steps_element(testcase_element, testcase, options=None):
     if testcase.steps:
         steps_element = SubElement(testcase_element, const.TAG_STEPS)
 
         for step in testcase.steps:
 
-            if is_should_skip(step.actions):
+            if is_should_skip(step.actions, options):
                 continue
 
             step_element = SubElement(steps_element, const.TAG_STEP)
-            gen_text_element(step_element, const.TAG_STEP_NUMBER, str(step.step_number))
-            gen_text_element(step_element, const.TAG_ACTIONS, step.actions)
-            gen_text_element(step_element, const.TAG_EXPECTEDRESULTS, step.expectedresults)
-            gen_text_element(step_element, const.TAG_EXECUTION_TYPE, _convert_execution_type(step.execution_type))
+            gen_text_element(step_element, const.TAG_STEP_NUMBER, str(step.step_number), options)
+            gen_text_element(step_element, const.TAG_ACTIONS, step.actions, options)
+            gen_text_element(step_element, const.TAG_EXPECTEDRESULTS, step.expectedresults, options)
+            gen_text_element(step_element, const.TAG_EXECUTION_TYPE, _convert_execution_type(step.execution_type), options)
 
 
-def gen_text_element(parent_element, tag_name, content):
+def gen_text_element(parent_element, tag_name, content, options=None):
     """generate an element's text conent: <![CDATA[text]]>"""
-    if is_should_parse(content):
+    if is_should_parse(content, options):
         child_element = SubElement(parent_element, tag_name)
         element_set_text(child_element, content)
 
 
 def element_set_text(element, content):
-    # retain html tags in content
-    content = escape(content, entities={'\r\n': '<br />'})
-    # replace new line for *nix system
-    content = content.replace('\n', '<br />')
-    # add the line break in source to make it readable
-    content = content.replace('<br />', '<br />\n')
+    content = _cdata_content(content)
 
     # add CDATA for a element
     element.append(Comment(' --><![CDATA[' + content.replace(']]>', ']]]]><![CDATA[>') + ']]> <!-- '))
 
 
-def is_should_parse(content):
+def is_should_parse(content, options=None):
     """An element that has a string content and doesn't start with exclamation mark should be parsing"""
-    return isinstance(content, str) and content.strip() != '' and not content[0] in config['ignore_char']
+    ignore_char = (options or ConversionOptions()).ignore_char
+    return isinstance(content, str) and content.strip() != '' and not content[0] in ignore_char
 
 
-def is_should_skip(content):
-    """A testsuite/testcase/teststep should be skip: 1、content is empty; 2、starts with config.ignore_char"""
+def is_should_skip(content, options=None):
+    """A testsuite/testcase/teststep should be skip: 1、content is empty; 2、starts with options.ignore_char"""
     return content is None or \
         not isinstance(content, str) or \
         content.strip() == '' or \
-        content[0] in config['ignore_char']
+        content[0] in (options or ConversionOptions()).ignore_char
 
 
 def _convert_execution_type(value):
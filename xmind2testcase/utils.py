@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 # _*_ coding:utf-8 _*_
-import json
 import os
-import xmind
 import logging
+import uuid
+from contextlib import contextmanager
 
-from xmindparser import is_xmind_zen, xmind_to_dict
+from xmindparser import open_xmind_document, iter_xmind_data, xmind_to_data
+from xmindparser.codec import dump_file, dump_array_file
 
-from xmind2testcase.parser import xmind_to_testsuites
+from xmind2testcase import cache, parallel
+from xmind2testcase.parser import iter_testcases, xmind_to_testsuites
 
 
 def get_absolute_path(path):
@@ -25,6 +27,37 @@ def get_absolute_path(path):
     return os.path.join(fp, fn)
 
 
+@contextmanager
+def replacing_file(file_path):
+    """Yield the path of a new temporary file next to the file, which replaces the file once the block is done
+
+    A failed conversion never leaves a partial file nor removes the last one, and the temporary file
+    has a unique name, so several threads may write the same file at once.
+    """
+    temp_file = _create_temp_file(os.path.dirname(os.path.abspath(file_path)))
+
+    try:
+        yield temp_file
+        os.replace(temp_file, file_path)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+def _create_temp_file(folder):
+    """Create a file with a unique name in the folder, its permissions are 0o666 without the umask bits
+    like any new file, unlike `tempfile.mkstemp` which creates it for the owner only"""
+    while True:
+        temp_file = os.path.join(folder, 'tmp{}.tmp'.format(uuid.uuid4().hex))
+
+        try:
+            os.close(os.open(temp_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+            return temp_file
+        except FileExistsError:
+            continue
+
+
 # def get_xmind_testsuites(xmind_file):
 #     """Load the XMind file and parse to `xmind2testcase.metadata.TestSuite` list"""
 #     xmind_file = get_absolute_path(xmind_file)
@@ -40,41 +73,121 @@ def get_absolute_path(path):
 #         return []
 
 
-def get_xmind_testsuites(xmind_file):
-    """Load the XMind file and parse to `xmind2testcase.metadata.TestSuite` list"""
-    xmind_file = get_absolute_path(xmind_file)
-    '''
-        适配xmind高版本
-    '''
-    if is_xmind_zen(xmind_file):
-        xmind_content_dict = xmind_to_dict(xmind_file)
-    else:
-        workbook = xmind.load(xmind_file)
-        xmind_content_dict = workbook.getData()
+def get_xmind_testsuites(xmind_file, sheets=None, options=None):
+    """Load the XMind file and parse to `xmind2testcase.metadata.TestSuite` list
+
+    :param xmind_file: the target XMind file, or an opened `xmindparser.XmindDocument` to avoid reading it again
+    :param sheets: only parse the selected sheets, a sheet index, a sheet title or a list of them, None for all sheets
+    :param options: the `xmind2testcase.parser.ConversionOptions` of this conversion, from `parser.config` by default
+
+    An unchanged file is taken from `xmind2testcase.cache.memory_cache`, then from `xmind2testcase.cache.disk_cache`
+    when they are enabled, instead of parsed again. Testsuites from the memory cache are shared, don't modify them.
+    An edited file only has its changed subtrees parsed when `xmind2testcase.cache.incremental_cache` is enabled.
+    """
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+        memory_key, disk_key, testsuites = _get_cached_testsuites(xmind_file, sheets, options)
+
+        if testsuites is None:
+            testsuites = parse_xmind_testsuites(document, sheets, options, _incremental_state_of(document, options))
+            _set_cached_testsuites(memory_key, disk_key, testsuites)
+
+    return testsuites
+
+
+def _get_cached_testsuites(xmind_file, sheets, options):
+    """Look up the testsuites in the caches, return (memory cache key, disk cache key, testsuites or None)"""
+    memory_key = cache.memory_cache.key_of(xmind_file, sheets, options) if cache.memory_cache else None
+
+    if memory_key:
+        testsuites = cache.memory_cache.get(memory_key)
+
+        if testsuites is not None:
+            logging.info('Take the testsuites of XMind file(%s) from the memory cache', xmind_file)
+            return memory_key, None, testsuites
+
+    disk_key = cache.disk_cache.key_of(xmind_file, sheets, options) if cache.disk_cache else None
+    testsuites = cache.disk_cache.get(disk_key) if disk_key else None
+
+    if testsuites is not None:
+        logging.info('Load the testsuites of XMind file(%s) from the disk cache', xmind_file)
+
+        if testsuites and memory_key:
+            cache.memory_cache.set(memory_key, testsuites)
+
+    return memory_key, disk_key, testsuites
+
+
+def _is_worth_parallel(document):
+    return parallel.parallel_parsing is not None and parallel.parallel_parsing.is_worth(document)
+
+
+def _incremental_state_of(document, options):
+    return cache.incremental_cache.state_of(document, options) if cache.incremental_cache else None
+
+
+def _set_cached_testsuites(memory_key, disk_key, testsuites):
+    if testsuites and disk_key:
+        cache.disk_cache.set(disk_key, testsuites)
+
+    if testsuites and memory_key:
+        cache.memory_cache.set(memory_key, testsuites)
+
+
+def parse_xmind_testsuites(xmind_file, sheets=None, options=None, incremental=None):
+    """Parse the XMind file to `xmind2testcase.metadata.TestSuite` list, without looking up any cache
+
+    :param sheets: only parse the selected sheets, see `xmindparser.xmind_to_dict`
+    :param options: the `xmind2testcase.parser.ConversionOptions` of this conversion
+    :param incremental: the `xmind2testcase.cache.IncrementalState` of the last conversion of the file,
+                        the unchanged subtrees are reused from it and it is updated with this conversion
+
+    Without `incremental`, a big file is parsed in worker processes when `xmind2testcase.parallel.parallel_parsing`
+    is enabled.
+    """
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+
+        if incremental is None and _is_worth_parallel(document):
+            return parallel.parallel_parsing.parse(xmind_file, sheets, options)
+
+        '''
+            适配xmind高版本, 旧版本由 xmindparser.xreader 读取, 不再依赖 xmind 包
+            主题读取为紧凑的 xmindparser.Topic, 大文件内存占用更低
+        '''
+        subtrees = incremental.subtrees if incremental else None
+        xmind_content_dict = xmind_to_data(document, compact=True, sheets=sheets, subtrees=subtrees)
     logging.debug("loading XMind file(%s) dict data: %s", xmind_file, xmind_content_dict)
 
     if xmind_content_dict:
-        testsuites = xmind_to_testsuites(xmind_content_dict)
+        testsuites = xmind_to_testsuites(xmind_content_dict, options, incremental.testsuites if incremental else None)
+
+        if incremental:
+            incremental.testsuites.finish()
         return testsuites
     else:
         logging.error('Invalid XMind file(%s): it is empty!', xmind_file)
         return []
 
 
-def get_xmind_testsuite_list(xmind_file):
+def get_xmind_testsuite_list(xmind_file, options=None):
     """Load the XMind file and get all testsuite in it
 
-    :param xmind_file: the target XMind file
+    :param xmind_file: the target XMind file, or an opened `xmindparser.XmindDocument`
+    :param options: the `xmind2testcase.parser.ConversionOptions` of this conversion
     :return: a list of testsuite data
     """
-    xmind_file = get_absolute_path(xmind_file)
-    logging.info('Start converting XMind file(%s) to testsuite data list...', xmind_file)
-    testsuite_list = get_xmind_testsuites(xmind_file)
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+        logging.info('Start converting XMind file(%s) to testsuite data list...', xmind_file)
+        testsuite_list = get_xmind_testsuites(document, options=options)
     suite_data_list = []
 
+    # the statistics are only put into the data, the testsuites may be shared by the memory cache
     for testsuite in testsuite_list:
+        suite_data = testsuite.to_dict()
         product_statistics = {'case_num': 0, 'non_execution': 0, 'pass': 0, 'failed': 0, 'blocked': 0, 'skipped': 0}
-        for sub_suite in testsuite.sub_suites:
+        for sub_suite, sub_suite_data in zip(testsuite.sub_suites, suite_data['sub_suites']):
             suite_statistics = {'case_num': len(sub_suite.testcase_list), 'non_execution': 0, 'pass': 0, 'failed': 0, 'blocked': 0, 'skipped': 0}
             for case in sub_suite.testcase_list:
                 if case.result == 0:
@@ -89,47 +202,130 @@ def get_xmind_testsuite_list(xmind_file):
                     suite_statistics['skipped'] += 1
                 else:
                     logging.warning('This testcase result is abnormal: %s, please check it: %s', case.result, case.to_dict())
-            sub_suite.statistics = suite_statistics
+            sub_suite_data['statistics'] = suite_statistics
             for item in product_statistics:
                 product_statistics[item] += suite_statistics[item]
 
-        testsuite.statistics = product_statistics
-        suite_data = testsuite.to_dict()
+        suite_data['statistics'] = product_statistics
         suite_data_list.append(suite_data)
 
     logging.info('Convert XMind file(%s) to testsuite data list successfully!', xmind_file)
     return suite_data_list
 
 
-def get_xmind_testcase_list(xmind_file):
-    """Load the XMind file and get all testcase in it
+def iter_xmind_testcases(xmind_file, sheets=None, options=None):
+    """Load the XMind file and yield the data of its testcases one by one, each one as soon as it is parsed
 
-    :param xmind_file: the target XMind file
-    :return: a list of testcase data
+    :param xmind_file: the target XMind file, or an opened `xmindparser.XmindDocument`
+    :param sheets: only parse the selected sheets, see `get_xmind_testsuites`
+    :param options: the `xmind2testcase.parser.ConversionOptions` of this conversion
+    :return: a generator of testcase data, with the 'product' and 'suite' of each testcase
     """
-    xmind_file = get_absolute_path(xmind_file)
-    logging.info('Start converting XMind file(%s) to testcases dict data...', xmind_file)
-    testsuites = get_xmind_testsuites(xmind_file)
-    testcases = []
+    for testsuite, suite, case in iter_xmind_testsuite_testcases(xmind_file, sheets, options):
+        yield _testcase_data(testsuite, suite, case)
+
+
+def iter_xmind_testsuite_testcases(xmind_file, sheets=None, options=None):
+    """Load the XMind file and yield (testsuite, sub testsuite, testcase) of each testcase as soon as it is parsed
+
+    The sheets are read one at a time. A cached XMind file is not parsed again, and the parsed testsuites
+    are put into the enabled caches once the generator ends, they are only kept for the caches.
+    The testsuites may be shared by the memory cache, don't modify them. A big file is parsed at once
+    in worker processes when `xmind2testcase.parallel.parallel_parsing` is enabled.
+    """
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+        logging.info('Start converting XMind file(%s) to testcases...', xmind_file)
+        memory_key, disk_key, testsuites = _get_cached_testsuites(xmind_file, sheets, options)
+
+        if testsuites is not None:
+            yield from _iter_testsuite_testcases(testsuites)
+        else:
+            testsuites = [] if memory_key or disk_key else None
+            yield from _parse_testsuite_testcases(document, sheets, options, testsuites)
+            _set_cached_testsuites(memory_key, disk_key, testsuites)
+
+    logging.info('Convert XMind file(%s) to testcases successfully!', xmind_file)
+
+
+def iter_xmind_testsuites(xmind_file, sheets=None, options=None):
+    """Load the XMind file and yield its `xmind2testcase.metadata.TestSuite`s one by one, each one as soon as its sheet is parsed
+
+    The same testsuites as `get_xmind_testsuites`, from the same caches, without waiting for the whole file.
+    The testsuites may be shared by the memory cache, don't modify them.
+    """
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+        memory_key, disk_key, testsuites = _get_cached_testsuites(xmind_file, sheets, options)
+
+        if testsuites is not None:
+            yield from testsuites
+            return
 
+        testsuites = []
+        done = 0
+
+        # a testsuite is added when its sheet starts, so the ones before the last are complete
+        for _ in _parse_testsuite_testcases(document, sheets, options, testsuites):
+            while done < len(testsuites) - 1:
+                yield testsuites[done]
+                done += 1
+
+        yield from testsuites[done:]
+        _set_cached_testsuites(memory_key, disk_key, testsuites)
+
+
+def _parse_testsuite_testcases(document, sheets, options, testsuites):
+    """Parse the opened XMind file and yield (testsuite, sub testsuite, testcase) of each testcase,
+    the testsuites are added to the `testsuites` list unless it is None"""
+    incremental = _incremental_state_of(document, options)
+
+    if incremental is None and _is_worth_parallel(document):
+        # the workers parse the whole file before any testcase is yielded
+        parsed = parallel.parallel_parsing.parse(document.file_path, sheets, options)
+
+        if testsuites is not None:
+            testsuites.extend(parsed)
+        yield from _iter_testsuite_testcases(parsed)
+    elif incremental:
+        xmind_content = iter_xmind_data(document, compact=True, sheets=sheets, subtrees=incremental.subtrees)
+        yield from iter_testcases(xmind_content, options, testsuites, incremental.testsuites)
+        incremental.testsuites.finish()
+    else:
+        xmind_content = iter_xmind_data(document, compact=True, sheets=sheets)
+        yield from iter_testcases(xmind_content, options, testsuites)
+
+
+def _iter_testsuite_testcases(testsuites):
     for testsuite in testsuites:
-        product = testsuite.name
         for suite in testsuite.sub_suites:
             for case in suite.testcase_list:
-                case_data = case.to_dict()
-                case_data['product'] = product
-                case_data['suite'] = suite.name
-                testcases.append(case_data)
+                yield testsuite, suite, case
+
+
+def _testcase_data(testsuite, suite, case):
+    case_data = case.to_dict()
+    case_data['product'] = testsuite.name
+    case_data['suite'] = suite.name
+    return case_data
+
 
-    logging.info('Convert XMind file(%s) to testcases dict data successfully!', xmind_file)
-    return testcases
+def get_xmind_testcase_list(xmind_file, options=None):
+    """Load the XMind file and get all testcase in it
+
+    :param xmind_file: the target XMind file, or an opened `xmindparser.XmindDocument`
+    :param options: the `xmind2testcase.parser.ConversionOptions` of this conversion
+    :return: a list of testcase data, see `iter_xmind_testcases`
+    """
+    return list(iter_xmind_testcases(xmind_file, options=options))
 
 
-def xmind_testsuite_to_json_file(xmind_file):
-    """Convert XMind file to a testsuite json file"""
-    xmind_file = get_absolute_path(xmind_file)
-    logging.info('Start converting XMind file(%s) to testsuites json file...', xmind_file)
-    testsuites = get_xmind_testsuite_list(xmind_file)
+def xmind_testsuite_to_json_file(xmind_file, compact=False, options=None):
+    """Convert XMind file to a testsuite json file, indented by 4 spaces unless `compact`"""
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+        logging.info('Start converting XMind file(%s) to testsuites json file...', xmind_file)
+        testsuites = get_xmind_testsuite_list(document, options)
     testsuite_json_file = xmind_file[:-6] + '_testsuite.json'
 
     if os.path.exists(testsuite_json_file):
@@ -137,27 +333,27 @@ def xmind_testsuite_to_json_file(xmind_file):
         # logging.info('The testsuite json file already exists, return it directly: %s', testsuite_json_file)
         # return testsuite_json_file
 
-    with open(testsuite_json_file, 'w', encoding='utf8') as f:
-        f.write(json.dumps(testsuites, indent=4, separators=(',', ': '), ensure_ascii=False))
-        logging.info('Convert XMind file(%s) to a testsuite json file(%s) successfully!', xmind_file, testsuite_json_file)
+    dump_file(testsuites, testsuite_json_file, indent=4, ensure_ascii=False, compact=compact)
+    logging.info('Convert XMind file(%s) to a testsuite json file(%s) successfully!', xmind_file, testsuite_json_file)
 
     return testsuite_json_file
 
 
-def xmind_testcase_to_json_file(xmind_file):
-    """Convert XMind file to a testcase json file"""
-    xmind_file = get_absolute_path(xmind_file)
-    logging.info('Start converting XMind file(%s) to testcases json file...', xmind_file)
-    testcases = get_xmind_testcase_list(xmind_file)
-    testcase_json_file = xmind_file[:-6] + '.json'
+def xmind_testcase_to_json_file(xmind_file, compact=False, options=None):
+    """Convert XMind file to a testcase json file, indented by 4 spaces unless `compact`
 
-    if os.path.exists(testcase_json_file):
-        os.remove(testcase_json_file)
+    Each testcase is written as soon as it is parsed, the testcase list is never built. They are written
+    to a temporary file which replaces the json file once complete, see `replacing_file`.
+    """
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+        logging.info('Start converting XMind file(%s) to testcases json file...', xmind_file)
+        testcase_json_file = xmind_file[:-6] + '.json'
         # logging.info('The testcase json file already exists, return it directly: %s', testcase_json_file)
-        # return testcase_json_file
 
-    with open(testcase_json_file, 'w', encoding='utf8') as f:
-        f.write(json.dumps(testcases, indent=4, separators=(',', ': '), ensure_ascii=False))
-        logging.info('Convert XMind file(%s) to a testcase json file(%s) successfully!', xmind_file, testcase_json_file)
+        with replacing_file(testcase_json_file) as temp_file:
+            testcases = iter_xmind_testcases(document, options=options)
+            dump_array_file(testcases, temp_file, indent=4, ensure_ascii=False, compact=compact)
+    logging.info('Convert XMind file(%s) to a testcase json file(%s) successfully!', xmind_file, testcase_json_file)
 
     return testcase_json_file
@@ -2,8 +2,9 @@
 # _*_ coding:utf-8 _*_
 import csv
 import logging
-import os
-from xmind2testcase.utils import get_xmind_testcase_list, get_absolute_path
+from xmindparser import open_xmind_document
+from xmind2testcase import cache
+from xmind2testcase.utils import iter_xmind_testsuite_testcases, replacing_file
 
 """
 Convert XMind fie to Zentao testcase csv file 
@@ -12,32 +13,77 @@ Zentao official document about import CSV testcase file: https://www.zentao.net/
 """
 
 
-def xmind_to_zentao_csv_file(xmind_file):
-    """Convert XMind file to a zentao csv file"""
-    xmind_file = get_absolute_path(xmind_file)
-    logging.info('Start converting XMind file(%s) to zentao file...', xmind_file)
-    testcases = get_xmind_testcase_list(xmind_file)
+def xmind_to_zentao_csv_file(xmind_file, options=None):
+    """Convert XMind file to a zentao csv file, each row is written as soon as its testcase is parsed
 
-    fileheader = ["所属模块", "用例标题", "前置条件", "步骤", "预期", "关键词", "优先级", "用例类型", "适用阶段"]
-    zentao_testcase_rows = [fileheader]
-    for testcase in testcases:
-        row = gen_a_testcase_row(testcase)
-        zentao_testcase_rows.append(row)
+    The rows are written to a temporary file next to the csv file, which replaces it once complete,
+    so a failed conversion never leaves a partial csv file nor removes the last one.
 
-    zentao_file = xmind_file[:-6] + '.csv'
-    if os.path.exists(zentao_file):
-        os.remove(zentao_file)
-        # logging.info('The zentao csv file already exists, return it directly: %s', zentao_file)
-        # return zentao_file
+    :param options: the `xmind2testcase.parser.ConversionOptions` of this conversion
+    """
+    with open_xmind_document(xmind_file) as document:
+        xmind_file = document.file_path
+        logging.info('Start converting XMind file(%s) to zentao file...', xmind_file)
 
-    with open(zentao_file, 'w', encoding='utf8') as f:
-        writer = csv.writer(f)
-        writer.writerows(zentao_testcase_rows)
-        logging.info('Convert XMind file(%s) to a zentao csv file(%s) successfully!', xmind_file, zentao_file)
+        fileheader = ["所属模块", "用例标题", "前置条件", "步骤", "预期", "关键词", "优先级", "用例类型", "适用阶段"]
+        zentao_file = xmind_file[:-6] + '.csv'
 
+        with replacing_file(zentao_file) as temp_file, open(temp_file, 'w', encoding='utf8') as f:
+            writer = csv.writer(f)
+            writer.writerow(fileheader)
+            writer.writerows(iter_testcase_rows(document, options))
+
+    logging.info('Convert XMind file(%s) to a zentao csv file(%s) successfully!', xmind_file, zentao_file)
     return zentao_file
 
 
+def iter_testcase_rows(xmind_file, options=None):
+    """Yield the row of each testcase of the XMind file as soon as it is parsed
+
+    When `xmind2testcase.cache.incremental_cache` is enabled, the rows of a testsuite unchanged since
+    the last conversion of the file are reused instead of generated again.
+    """
+    with open_xmind_document(xmind_file) as document:
+        state = cache.incremental_cache.state_of(document, options) if cache.incremental_cache else None
+        rows_cache = state.rows if state else None
+        current, rows, reused = None, None, False
+
+        for _, suite, testcase in iter_xmind_testsuite_testcases(document, options=options):
+            # identical subtrees share a reused testsuite, which may come again right after itself
+            if suite is not current or testcase is suite.testcase_list[0]:
+                if rows is not None:
+                    rows_cache.set(current, rows)
+
+                current, rows = suite, None
+                cached_rows = rows_cache.get(suite) if rows_cache is not None else None
+                reused = cached_rows is not None
+
+                if reused:
+                    yield from cached_rows
+                elif rows_cache is not None:
+                    rows = []
+
+            if reused:
+                continue
+
+            row = gen_testcase_row(suite, testcase)
+            if rows is not None:
+                rows.append(row)
+            yield row
+
+        if rows is not None:
+            rows_cache.set(current, rows)
+        if rows_cache is not None:
+            rows_cache.finish()
+
+
+def gen_testcase_row(suite, testcase):
+    """Generate the row of a `TestCase` in the `TestSuite` directly, the same as `gen_a_testcase_row` of its data"""
+    case_step, case_expected_result = gen_steps_and_expected_results(testcase.steps)
+    return [gen_case_module(suite.name), testcase.name, testcase.preconditions, case_step, case_expected_result, '',
+            gen_case_priority(testcase.importance), gen_case_type(testcase.execution_type), '功能测试阶段']
+
+
 def gen_a_testcase_row(testcase_dict):
     case_module = gen_case_module(testcase_dict['suite'])
     case_title = testcase_dict['name']
@@ -61,14 +107,21 @@ def gen_case_module(module_name):
 
 
 def gen_case_step_and_expected_result(steps):
-    case_step = ''
-    case_expected_result = ''
-
-    for step_dict in steps:
-        case_step += str(step_dict['step_number']) + '. ' + step_dict['actions'].replace('\n', '').strip() + '\n'
-        case_expected_result += str(step_dict['step_number']) + '. ' + \
-            step_dict['expectedresults'].replace('\n', '').strip() + '\n' \
-            if step_dict.get('expectedresults', '') else ''
+    case_step = ''.join(['%s. %s\n' % (step_dict['step_number'], step_dict['actions'].replace('\n', '').strip())
+                         for step_dict in steps])
+    case_expected_result = ''.join(['%s. %s\n' % (step_dict['step_number'],
+                                                  step_dict['expectedresults'].replace('\n', '').strip())
+                                    for step_dict in steps if step_dict.get('expectedresults', '')])
+
+    return case_step, case_expected_result
+
+
+def gen_steps_and_expected_results(steps):
+    """The same as `gen_case_step_and_expected_result` of the `TestStep` list"""
+    steps = steps or ()
+    case_step = ''.join(['%s. %s\n' % (step.step_number, step.actions.replace('\n', '').strip()) for step in steps])
+    case_expected_result = ''.join(['%s. %s\n' % (step.step_number, step.expectedresults.replace('\n', '').strip())
+                                    for step in steps if step.expectedresults])
 
     return case_step, case_expected_result
 
@@ -10,6 +10,8 @@ from PyQt5.QtCore import Qt, QEvent, QThread, pyqtSignal
 from PyQt5.QtGui import QFont, QColor, QCursor, QIcon
 from datetime import datetime
 
+from xmindparser import open_xmind_document
+from xmind2testcase.cache import enable_disk_cache, enable_incremental_cache, enable_memory_cache
 from xmind2testcase.utils import get_xmind_testcase_list, get_xmind_testsuites
 from xmind2testcase.zentao import xmind_to_zentao_csv_file
 
@@ -161,9 +163,11 @@ class BatchInstallWindow(QMainWindow):
 class PreviewWindow(QMainWindow):
     def __init__(self, xmind_file, testcases, x, y):
         super().__init__()
-        self.xmind_file = xmind_file
         self.test_cases = testcases  # 将 JSON 数据保存为类的成员变量
-        testsuites = get_xmind_testsuites(xmind_file)
+        # xmind_file 可以是已打开的 XmindDocument，避免重复读取文件
+        with open_xmind_document(xmind_file) as document:
+            self.xmind_file = document.file_path
+            testsuites = get_xmind_testsuites(document)
         self.suite_count = 0
         for suite in testsuites:
             self.suite_count += len(suite.sub_suites)
@@ -446,6 +450,11 @@ class MainWindow(QMainWindow):
         self.saved_geometry = self.geometry()
         self.upload_folder = "upload"
         os.makedirs(self.upload_folder, exist_ok=True)
+        # 缓存解析结果，重复预览、导出同一文件时无需重新解析
+        enable_memory_cache()
+        enable_disk_cache(os.path.join(self.upload_folder, ".cache"))
+        # 文件修改后重新上传、导出时，只重新解析改动过的子主题
+        self.incremental_cache = enable_incremental_cache()
         self.initUI()
 
     def initUI(self):
@@ -628,12 +637,12 @@ class MainWindow(QMainWindow):
             self.show_message("错误", f"文件 {file_name} 不存在")
             return
 
-        testcases = get_xmind_testcase_list(file_path)
-
         current_geometry = self.geometry()
         x, y = current_geometry.x() + 20, current_geometry.y() + 20  # 小幅度偏移
 
-        self.preview_window = PreviewWindow(file_path, testcases, x, y)
+        with open_xmind_document(file_path) as document:
+            testcases = get_xmind_testcase_list(document)
+            self.preview_window = PreviewWindow(document, testcases, x, y)
         self.preview_window.show()
         self.close()
 
@@ -680,16 +689,18 @@ class MainWindow(QMainWindow):
 
             try:
                 shutil.copy(self.selected_file_path, destination)  # 复制文件到目标位置
+                # 同一文件的每次上传都是新的副本，按原文件共用增量缓存
+                self.incremental_cache.set_source(destination, self.selected_file_path)
                 create_on = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 # 使用带时间戳的文件名插入记录
                 self.db.insert_record(name=os.path.basename(destination), create_on=create_on, note="上传的XMind文件")
 
-                testcases = get_xmind_testcase_list(destination)
-
                 current_geometry = self.geometry()
                 x, y = current_geometry.x() + 20, current_geometry.y() + 20  # 小幅度偏移
 
-                self.preview_window = PreviewWindow(destination, testcases, x, y)
+                with open_xmind_document(destination) as document:
+                    testcases = get_xmind_testcase_list(document)
+                    self.preview_window = PreviewWindow(document, testcases, x, y)
                 self.preview_window.show()
                 self.close()
             except Exception as e:
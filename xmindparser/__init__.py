@@ -2,10 +2,11 @@
 Parse xmind to programmable data types.
 """
 
-import json
 import logging
 import os
 import sys
+from contextlib import contextmanager
+from io import BytesIO
 from zipfile import ZipFile
 
 config = {'logName': __name__,
@@ -14,7 +15,6 @@ config = {'logName': __name__,
           'showTopicId': False,
           'hideEmptyValue': True}
 
-cache = {}
 _log_name = config['logName'] or __file__
 _log_level = config['logLevel'] or logging.WARNING
 _log_fmt = config['logFormat'] or '%(asctime)s %(levelname)-8s: %(message)s'
@@ -30,44 +30,327 @@ def set_logger_level(new_level):
     logger.setLevel(new_level)
 
 
+class XmindDocument(object):
+    """An opened xmind file, the archive directory and each member are read only once."""
+
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(os.path.expanduser(file_path))
+        self._zip = ZipFile(self.file_path)
+        self._names = set(self._zip.namelist())
+        self._members = {}
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def is_zen(self):
+        return 'content.json' in self._names
+
+    def size_of(self, name):
+        """The uncompressed size of a member of the archive in bytes."""
+        return self._zip.getinfo(name).file_size
+
+    def read(self, name):
+        """Read a member of the archive as bytes, the result is kept for later calls."""
+        if name not in self._members:
+            self._members[name] = self._zip.read(name)
+
+        return self._members[name]
+
+    def open(self, name):
+        """Open a member of the archive as a binary stream, useful to parse big members incrementally."""
+        if name in self._members:
+            return BytesIO(self._members[name])
+
+        return self._zip.open(name)
+
+    def close(self):
+        self._members.clear()
+        self._zip.close()
+
+
+class ParseContext(object):
+    """State of parsing one `XmindDocument`, readers take it explicitly so files can be parsed in parallel."""
+
+    def __init__(self, document):
+        self.document = document
+        self.comments = {}
+        self.topics = {}
+        self.subtrees = None
+        self.main_topics = None
+        self.main_topic_count = 0
+
+
+class Topic(object):
+    """A compact topic of `xmind_to_data(file_path, compact=True)`, much smaller than the dict of the same data.
+
+    Markers are a tuple of interned strings, `topics` is only set when there are sub topics. It reads like
+    the dict of `xmind_to_data`: `topic['title']`, `topic.get('topics', [])`, `topic['topics'] = [...]`.
+    """
+    __slots__ = ('id', 'title', 'note', 'label', 'comment', 'markers', 'link', 'image', 'topics')
+
+    def __init__(self, id=None, title=None, note=None, label=None, comment=None, markers=(), link=None, image=None):
+        self.id = id
+        self.title = title
+        self.note = note
+        self.label = label
+        self.comment = comment
+        self.markers = tuple(sys.intern(m) for m in markers if m) if markers else ()
+        self.link = link
+        self.image = image
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return 'Topic(title={!r}, topics={})'.format(self.title, len(self.get('topics', ())))
+
+
+class SubtreeCache(object):
+    """The results of the last conversion of a file by their keys, e.g. the converted topic subtrees by fingerprint.
+
+    `get` and `set` fill the current conversion, `finish` ends it and drops the results it didn't use.
+    """
+
+    def __init__(self):
+        self._previous = {}
+        self._current = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def get(self, key):
+        value = self._current.get(key)
+
+        if value is None:
+            value = self._previous.get(key)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._current[key] = value
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._current[key] = value
+
+    def finish(self):
+        self._previous, self._current = self._current, {}
+
+
+@contextmanager
+def open_xmind_document(file_path):
+    """Open a xmind file as `XmindDocument`, an already opened document is used as is and left open."""
+    if isinstance(file_path, XmindDocument):
+        yield file_path
+    else:
+        with XmindDocument(file_path) as document:
+            yield document
+
+
 def is_xmind_zen(file_path):
     """Determine if this is a xmind zen file type."""
-    with ZipFile(file_path) as xmind:
-        return 'content.json' in xmind.namelist()
+    with open_xmind_document(file_path) as document:
+        return document.is_zen
 
 
 def get_xmind_zen_builtin_json(file_path):
     """Read internal content.json from xmind zen file."""
     name = "content.json"
-    with ZipFile(file_path) as xmind:
-        if name in xmind.namelist():
-            content = xmind.open(name).read().decode('utf-8')
-            return json.loads(content)
+    with open_xmind_document(file_path) as document:
+        if name in document:
+            from .codec import loads
+            return loads(document.read(name))
 
         raise AssertionError("Not a xmind zen file type!")
 
 
 def _get_out_file_name(xmind_file, suffix):
+    if isinstance(xmind_file, XmindDocument):
+        xmind_file = xmind_file.file_path
+
     assert isinstance(xmind_file, str) and xmind_file.endswith('.xmind'), "Invalid xmind file!"
     name = os.path.abspath(xmind_file[0:-5] + suffix)
 
     return name
 
 
-def xmind_to_dict(file_path):
-    """Open and convert xmind to dict type."""
-    if is_xmind_zen(file_path):
-        from .zenreader import open_xmind, get_sheets, sheet_to_dict
-    else:
-        from .xreader import open_xmind, get_sheets, sheet_to_dict
+def _reader_of(document):
+    if document.is_zen:
+        from . import zenreader
+        return zenreader
 
-    open_xmind(file_path)
-    data = []
+    from . import xreader
+    return xreader
 
-    for s in get_sheets():
-        data.append(sheet_to_dict(s))
 
-    return data
+def get_sheet_titles(file_path):
+    """List the sheet titles of a xmind file in order, without converting any topic."""
+    with open_xmind_document(file_path) as document:
+        reader = _reader_of(document)
+        return reader.get_sheet_titles(reader.open_xmind(document))
+
+
+def _select_sheets(document, sheets):
+    """Get the set of sheet indexes selected by `sheets`, None selects all sheets.
+
+    `sheets` is a sheet index, a sheet title or a list of them, a negative index counts from the last sheet.
+    The sheet titles are only listed when a title or a negative index is given.
+    """
+    if sheets is None:
+        return None
+
+    if isinstance(sheets, (int, str)):
+        sheets = [sheets]
+
+    titles = None
+    selected = set()
+
+    for s in sheets:
+        if isinstance(s, int) and s >= 0:
+            selected.add(s)
+            continue
+
+        if titles is None:
+            titles = get_sheet_titles(document)
+
+        if isinstance(s, int):
+            if s + len(titles) >= 0:
+                selected.add(s + len(titles))
+        else:
+            indexes = [i for i, title in enumerate(titles) if title == s]
+            if not indexes:
+                logger.warning('No sheet titled {!r} in {}'.format(s, document.file_path))
+            selected.update(indexes)
+
+    return selected
+
+
+def iter_xmind_dict(file_path, sheets=None):
+    """Open a xmind file and convert its sheets to dict type one at a time, see `xmind_to_dict`.
+
+    A sheet is only converted when the generator gets to it, a file path is kept open until the generator ends.
+    """
+    with open_xmind_document(file_path) as document:
+        reader = _reader_of(document)
+        selected = _select_sheets(document, sheets)
+        context = reader.open_xmind(document)
+
+        for s in reader.get_sheets(context, selected=selected):
+            yield reader.sheet_to_dict(s, context)
+
+
+def xmind_to_dict(file_path, sheets=None):
+    """Open and convert xmind to dict type, `file_path` can also be an opened `XmindDocument`.
+
+    Only the sheets selected by `sheets` are converted: an index, a title or a list of them, in document order.
+    """
+    return list(iter_xmind_dict(file_path, sheets))
+
+
+def iter_xmind_data(file_path, compact=False, sheets=None, subtrees=None, main_topics=None):
+    """Open a xmind file and convert its sheets to the type of `xmind_to_data` one at a time.
+
+    A sheet is only converted when the generator gets to it, a file path is kept open until the generator ends.
+    """
+    if subtrees is not None and not compact:
+        raise ValueError('Only the compact topics can be reused from the subtrees')
+
+    if main_topics is not None and not compact:
+        raise ValueError('Only the compact topics can be selected by main_topics')
+
+    with open_xmind_document(file_path) as document:
+        if document.is_zen:
+            if not compact:
+                yield from iter_xmind_dict(document, sheets)
+                return
+
+            from .zenreader import open_xmind, get_sheets, sheet_to_dict as sheet_to_data, node_to_topic
+            selected = _select_sheets(document, sheets)
+            context = open_xmind(document)
+            context.subtrees = subtrees
+            context.main_topics = main_topics
+            data = (sheet_to_data(s, context, node_to_topic) for s in get_sheets(context, selected=selected))
+        else:
+            from .xreader import open_xmind, get_sheets, sheet_to_data, node_to_data, node_to_topic
+
+            convert_node = node_to_topic if compact else node_to_data
+            selected = _select_sheets(document, sheets)
+            context = open_xmind(document)
+            context.subtrees = subtrees
+            context.main_topics = main_topics
+            data = (sheet_to_data(s, context, convert_node) for s in get_sheets(context, convert_node, selected))
+
+        if main_topics is not None:
+            data = _select_main_topics(data, main_topics)
+
+        yield from data
+
+    if subtrees is not None:
+        subtrees.finish()
+
+
+def _select_main_topics(data, main_topics):
+    """Leave the main topics out of the sheets unless `main_topics` is true for their number.
+
+    The main topics are the topics attached to the root topic of each sheet, they are numbered from 0
+    through all the converted sheets in order. The readers put empty topics in place of the ones left out.
+    """
+    number = 0
+
+    for sheet in data:
+        root = sheet['topic']
+        topics = root.get('topics')
+
+        if topics:
+            selected = [t for n, t in enumerate(topics, number) if main_topics(n)]
+            number += len(topics)
+
+            if selected:
+                root.topics = selected
+            else:
+                del root.topics
+
+        yield sheet
+
+
+def xmind_to_data(file_path, compact=False, sheets=None, subtrees=None, main_topics=None):
+    """Open and convert xmind to the dict type of `xmind.load(file_path).getData()`, used by xmind2testcase.
+
+    XMind zen files are converted by `xmind_to_dict` which already gives this type, legacy files are
+    read by the in-tree `xreader` instead of the DOM based `xmind` package. With `compact` the topics
+    are `Topic` instead of dict, which saves most of the memory on big maps. `sheets` selects the
+    sheets to convert like `xmind_to_dict`.
+
+    With a `SubtreeCache` kept from the last conversion of the file in `subtrees`, the subtrees below the
+    root topics which are unchanged are not converted again, their `Topic` objects are reused (compact only).
+    A content.xml larger than `xreader.max_reuse_size` is streamed and converted again instead.
+    `main_topics` converts a part of the file, see `_select_main_topics` (compact only).
+    """
+    return list(iter_xmind_data(file_path, compact, sheets, subtrees, main_topics))
 
 
 def xmind_to_file(file_path, file_type):
@@ -81,27 +364,23 @@ def xmind_to_file(file_path, file_type):
         raise ValueError('Not supported file type: {}'.format(file_type))
 
 
-def xmind_to_json(file_path):
+def xmind_to_json(file_path, compact=False):
+    """Convert xmind to a json file, indented by 2 spaces unless `compact`."""
+    from .codec import dump_file
     target = _get_out_file_name(file_path, 'json')
-
-    with open(target, 'w', encoding='utf8') as f:
-        f.write(json.dumps(xmind_to_dict(file_path), indent=2))
+    dump_file(xmind_to_dict(file_path), target, indent=2, compact=compact)
 
     return target
 
 
 def xmind_to_xml(file_path):
-    try:
-        from dicttoxml import dicttoxml
-        from xml.dom.minidom import parseString
-        target = _get_out_file_name(file_path, 'xml')
-        xml = dicttoxml(xmind_to_dict(file_path), custom_root='root')
-        xml = parseString(xml.decode('utf8')).toprettyxml(encoding='utf8')
-
-        with open(target, 'w', encoding='utf8') as f:
-            f.write(xml.decode('utf8'))
-
-        return target
-    except ImportError:
-        raise ImportError('Parse xmind to xml require "dicttoxml", try install via pip:\n' +
-                          '> pip install dicttoxml')
+    """Convert xmind to a xml file, indented by tabs, each sheet is written as soon as it is converted.
+
+    The document is the one `dicttoxml` gave for `xmind_to_dict(file_path)` with `custom_root='root'`,
+    pretty printed by minidom, see `xmlwriter.dump_array_file`. dicttoxml is not required anymore.
+    """
+    from .xmlwriter import dump_array_file
+    target = _get_out_file_name(file_path, 'xml')
+    dump_array_file(iter_xmind_dict(file_path), target, root='root')
+
+    return target
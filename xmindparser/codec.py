@@ -0,0 +1,254 @@
+"""
+JSON decoding and encoding, with orjson when it is installed and the json module as fallback.
+"""
+
+import json
+import os
+import re
+from json.decoder import scanstring
+from json.scanner import NUMBER_RE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_non_ascii = re.compile('[^\n -~]')
+_indent = re.compile(b'^ +', re.MULTILINE)
+_whitespace = re.compile('[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+_constants = {'null': None, 'true': True, 'false': False,
+              'NaN': float('nan'), 'Infinity': float('inf'), '-Infinity': float('-inf')}
+
+
+def loads(content):
+    """decode json from bytes, e.g. an archive member read as is, or str.
+
+    Without orjson a document nested too deep for the recursive json decoder, e.g. a very deep map,
+    is decoded again by `raw_decode` without recursion.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+
+    try:
+        return json.loads(content)
+    except RecursionError:
+        pass
+
+    if not isinstance(content, str):
+        content = content.decode(json.detect_encoding(content), 'surrogatepass')
+
+    obj, end = raw_decode(content, _whitespace.match(content).end())
+    end = _whitespace.match(content, end).end()
+
+    if end != len(content):
+        raise json.JSONDecodeError('Extra data', content, end)
+    return obj
+
+
+def raw_decode(content, pos=0):
+    """decode a json value from a str at pos like `json.JSONDecoder().raw_decode`, return (value, end).
+
+    A value nested too deep for the recursive json decoder is decoded with an explicit stack instead.
+    """
+    try:
+        return _decoder.raw_decode(content, pos)
+    except RecursionError:
+        return _decode_nested(content, pos)
+
+
+def _decode_nested(content, pos):
+    """decode a json value like `raw_decode` without recursion, the open containers are kept on a stack."""
+    stack = []  # [container, key] of the open containers, the key of the next value for an object
+
+    while True:
+        char = content[pos:pos + 1]
+
+        if char == '{':
+            pos = _whitespace.match(content, pos + 1).end()
+
+            if content[pos:pos + 1] != '}':
+                key, pos = _decode_key(content, pos)
+                stack.append([{}, key])
+                continue
+
+            value, pos = {}, pos + 1
+        elif char == '[':
+            pos = _whitespace.match(content, pos + 1).end()
+
+            if content[pos:pos + 1] != ']':
+                stack.append([[], None])
+                continue
+
+            value, pos = [], pos + 1
+        elif char == '"':
+            value, pos = scanstring(content, pos + 1)
+        else:
+            value, pos = _decode_scalar(content, pos)
+
+        # put the value into its container, then close the containers which end after it
+        while stack:
+            container, key = stack[-1]
+
+            if key is None:
+                container.append(value)
+            else:
+                container[key] = value
+
+            pos = _whitespace.match(content, pos).end()
+            char = content[pos:pos + 1]
+
+            if char == ',':
+                pos = _whitespace.match(content, pos + 1).end()
+
+                if key is not None:
+                    stack[-1][1], pos = _decode_key(content, pos)
+                break
+
+            if char != (']' if key is None else '}'):
+                raise json.JSONDecodeError("Expecting ',' delimiter", content, pos)
+
+            value, pos = container, pos + 1
+            stack.pop()
+        else:
+            return value, pos
+
+
+def _decode_key(content, pos):
+    """decode an object key and its ':' delimiter, return (key, the position of the value)."""
+    if content[pos:pos + 1] != '"':
+        raise json.JSONDecodeError('Expecting property name enclosed in double quotes', content, pos)
+
+    key, pos = scanstring(content, pos + 1)
+    pos = _whitespace.match(content, pos).end()
+
+    if content[pos:pos + 1] != ':':
+        raise json.JSONDecodeError("Expecting ':' delimiter", content, pos)
+
+    return key, _whitespace.match(content, pos + 1).end()
+
+
+def _decode_scalar(content, pos):
+    for name, value in _constants.items():
+        if content.startswith(name, pos):
+            return value, pos + len(name)
+
+    match = NUMBER_RE.match(content, pos)
+
+    if match is None:
+        raise json.JSONDecodeError('Expecting value', content, pos)
+
+    integer, frac, exp = match.groups()
+
+    if frac or exp:
+        return float(integer + (frac or '') + (exp or '')), match.end()
+
+    return int(integer), match.end()
+
+
+def dumps(obj):
+    """encode obj into compact json bytes, e.g. to fingerprint it."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass
+
+    return json.dumps(obj, separators=(',', ':')).encode('ascii')
+
+
+def dump_file(obj, file_path, indent=None, ensure_ascii=True, compact=False):
+    """encode obj into a json file, the same bytes as `json.dumps(obj, indent=indent, ensure_ascii=ensure_ascii)`
+    written to a text file, separators are (',', ': ') with indent.
+
+    With `compact` there is no indent nor space, separators are (',', ':').
+    """
+    if orjson is not None and (indent or compact):
+        try:
+            content = _orjson_dumps(obj, indent, ensure_ascii, compact)
+        except orjson.JSONEncodeError:
+            pass  # e.g. a lone surrogate in a str or a non-str key, which json handles
+        else:
+            if os.linesep != '\n':
+                content = content.replace(b'\n', os.linesep.encode('ascii'))  # like a file opened in text mode
+
+            with open(file_path, 'wb') as f:
+                f.write(content)
+            return
+
+    # json.dump writes many small chunks, it is slower than encoding the whole string at once
+    if compact:
+        content = json.dumps(obj, separators=(',', ':'), ensure_ascii=ensure_ascii)
+    else:
+        content = json.dumps(obj, indent=indent, separators=(',', ': ') if indent else None, ensure_ascii=ensure_ascii)
+
+    with open(file_path, 'w', encoding='utf8') as f:
+        f.write(content)
+
+
+def dump_array_file(items, file_path, indent=None, ensure_ascii=True, compact=False):
+    """encode the items of an iterable into a json array file one by one, the same bytes as
+    `dump_file(list(items), ...)` without holding the list, each item is written as soon as it is taken.
+    """
+    if compact:
+        separator, prefix = ',', ''
+    elif indent is not None:
+        separator, prefix = ',', '\n' + ' ' * indent  # each item is indented one more level
+    else:
+        separator, prefix = ', ', ''
+
+    with open(file_path, 'w', encoding='utf8') as f:
+        f.write('[')
+        first = True
+
+        for item in items:
+            content = _dumps(item, indent, ensure_ascii, compact)
+
+            if prefix:
+                content = content.replace('\n', prefix)  # a str never contains a raw newline
+
+            f.write(prefix + content if first else separator + prefix + content)
+            first = False
+
+        if prefix and not first:
+            f.write('\n')
+        f.write(']')
+
+
+def _dumps(obj, indent, ensure_ascii, compact):
+    if orjson is not None and (indent or compact):
+        try:
+            return _orjson_dumps(obj, indent, ensure_ascii, compact).decode('utf8')
+        except orjson.JSONEncodeError:
+            pass
+
+    if compact:
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=ensure_ascii)
+
+    return json.dumps(obj, indent=indent, separators=(',', ': ') if indent else None, ensure_ascii=ensure_ascii)
+
+
+def _orjson_dumps(obj, indent, ensure_ascii, compact):
+    if compact:
+        content = orjson.dumps(obj)
+    else:
+        content = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+        # a str never contains a raw newline, each line starts with its indent only
+        if indent != 2:
+            content = _indent.sub(lambda m: b' ' * (len(m.group()) // 2 * indent), content)
+
+    if ensure_ascii:
+        content = _non_ascii.sub(_escape, content.decode('utf8')).encode('ascii')
+
+    return content
+
+
+def _escape(match):
+    n = ord(match.group())
+
+    if n > 0xffff:
+        n -= 0x10000
+        return '\\u{0:04x}\\u{1:04x}'.format(0xd800 | (n >> 10), 0xdc00 | (n & 0x3ff))
+
+    return '\\u{0:04x}'.format(n)
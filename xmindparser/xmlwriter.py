@@ -0,0 +1,157 @@
+"""
+XML encoding of the converted data, the document of `dicttoxml` pretty printed by minidom, without either of them.
+"""
+
+import numbers
+import re
+from xml.dom.minidom import parseString
+
+# the characters which are not allowed in a xml document, a lone surrogate can't even be encoded
+invalid_xml_chars = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+# the element names and attributes of the dict keys, see `_element_of`
+_elements = {}
+
+
+def dump_array_file(items, file_path, root='root'):
+    """encode the items of an iterable into a xml file one by one, the same text as
+    `parseString(dicttoxml(list(items), custom_root=root)).toprettyxml(encoding='utf8')` decoded,
+    each item is written as soon as it is taken.
+
+    Each item is an <item> element of the root, with the type attributes of dicttoxml: dict, list, str,
+    int, float, number, bool or null. The topic trees are walked without recursion.
+    """
+    with open(file_path, 'w', encoding='utf8') as f:
+        write = f.write
+        write('<?xml version="1.0" encoding="utf8"?>\n')
+        empty = True
+
+        for item in items:
+            if empty:
+                write('<{}>\n'.format(root))
+                empty = False
+
+            _write_element(write, 'item', '', item, 1, True)
+
+        write('<{}/>\n'.format(root) if empty else '</{}>\n'.format(root))
+
+
+def _write_element(write, name, attrs, value, level, in_list):
+    # the end tags are put on the stack between the elements, to be written after the children
+    stack = [(name, attrs, value, level, in_list)]
+
+    while stack:
+        entry = stack.pop()
+
+        if isinstance(entry, str):
+            write(entry)
+            continue
+
+        name, attrs, value, level, in_list = entry
+        indent = '\t' * level
+
+        if isinstance(value, dict):
+            children = [_element_of(k) + (v, level + 1, False) for k, v in value.items()]
+            value_type = 'dict'
+        elif isinstance(value, (str, numbers.Number)) or value is None:
+            value_type, text = _text_of(value, in_list)
+
+            if text:
+                write('{0}<{1}{2} type="{3}">{4}</{1}>\n'.format(indent, name, attrs, value_type, text))
+            else:
+                write('{}<{}{} type="{}"/>\n'.format(indent, name, attrs, value_type))
+            continue
+        elif hasattr(value, '__iter__'):
+            children = [('item', '', v, level + 1, True) for v in value]
+            value_type = 'list'
+        else:
+            raise TypeError('Unsupported data type: %s (%s)' % (value, type(value).__name__))
+
+        if children:
+            write('{}<{}{} type="{}">\n'.format(indent, name, attrs, value_type))
+            stack.append('{}</{}>\n'.format(indent, name))
+            stack.extend(reversed(children))
+        else:
+            write('{}<{}{} type="{}"/>\n'.format(indent, name, attrs, value_type))
+
+
+def _text_of(value, in_list):
+    """the type attribute and the escaped text of a value, a bool is 'True' in a list and 'true' in a dict."""
+    if value is None:
+        return 'null', ''
+
+    if isinstance(value, bool):
+        return 'bool', str(value) if in_list else str(value).lower()
+
+    if isinstance(value, str):
+        value_type = 'str'
+    elif type(value) in (int, float):
+        value_type = type(value).__name__
+        value = str(value)
+    else:
+        value_type = 'number'
+        value = str(value)
+
+    return value_type, escape_text(value)
+
+
+def _element_of(key):
+    """the element name and attributes of a dict key like dicttoxml: a number is prefixed by n, the spaces
+    are replaced by underscores, and any other key which is not a valid element name is <key name="...">."""
+    element = _elements.get(key) if isinstance(key, str) else None
+
+    if element is None:
+        element = _make_element(key)
+
+        if isinstance(key, str) and len(_elements) < 4096:
+            _elements[key] = element
+
+    return element
+
+
+def _make_element(key):
+    name = key.replace('&', '&amp;').replace('"', '&quot;').replace('\'', '&apos;').replace(
+        '<', '&lt;').replace('>', '&gt;') if isinstance(key, str) else key
+
+    element_name = _parse_name(name)
+
+    if element_name is not None:
+        return element_name, ''
+
+    if str(name).isdigit():
+        return 'n{}'.format(name), ''
+
+    try:
+        return 'n{}'.format(float(str(name))), ''
+    except ValueError:
+        pass
+
+    element_name = _parse_name(name.replace(' ', '_'))
+
+    if element_name is not None:
+        return element_name, ''
+
+    # the line breaks, then the tabs and line breaks of an attribute are normalized when it is parsed
+    attr = key.replace('\r\n', '\n').replace('\r', '\n').replace('\n', ' ').replace('\t', ' ')
+    return 'key', ' name="{}"'.format(escape_xml(attr))
+
+
+def _parse_name(name):
+    """the element name of a start tag <name> as it is parsed, e.g. without trailing spaces, None if it is invalid."""
+    try:
+        return parseString('<?xml version="1.0" encoding="UTF-8" ?><{0}>foo</{0}>'.format(name)).documentElement.tagName
+    except Exception:
+        return None
+
+
+def escape_text(text):
+    """escape the text of an element, the line breaks are normalized as they are when it is parsed"""
+    return escape_xml(text.replace('\r\n', '\n').replace('\r', '\n'))
+
+
+def escape_xml(text):
+    """escape a text or an attribute value, raise ValueError if it has a character which is not allowed in xml"""
+    if invalid_xml_chars.search(text):
+        raise ValueError('Invalid character in xml: {!r}'.format(text))
+
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
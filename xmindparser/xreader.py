@@ -1,37 +1,367 @@
+import hashlib
 import re
-from xml.etree import ElementTree as  ET
-from xml.etree.ElementTree import Element
-from zipfile import ZipFile
+from io import BytesIO
+from xml.etree import ElementTree
 
-from . import config, logger, cache
+from . import config, logger, ParseContext, Topic
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
 content_xml = "content.xml"
 comments_xml = "comments.xml"
+xlink_href = '{http://www.w3.org/1999/xlink}href'
+
+# the attributes which mark the topics reused or converted by `reuse_subtrees`
+reuse_attr = 'xmindparser-reuse'
+subtree_attr = 'xmindparser-subtree'
+
+# a topic start, end or empty tag, a '>' may only appear quoted in its attributes
+topic_tag = re.compile(rb'<(/?)topic(?=[\s/>])(?:[^>"\'/]|/(?!>)|"[^"]*"|\'[^\']*\')*(/?)>')
+# the same for the sheet, topics and topic tags, with the attributes
+outline_tag = re.compile(rb'<(/?)(sheet|topics?)(?=[\s/>])((?:[^>"\'/]|/(?!>)|"[^"]*"|\'[^\']*\')*)(/?)>')
+attached_type = re.compile(rb'\stype\s*=\s*["\']attached["\']')
+
+# the largest content.xml in bytes (uncompressed) whose subtrees are reused, see `reuse_subtrees`, which reads
+# it at once; a larger one is streamed as without `context.subtrees` and all its topics are converted again
+max_reuse_size = 16 * 1024 * 1024
+
+# the ElementTree implementation in use and its name, see `use_backend`
+ET = ElementTree
+backend = 'etree'
+
+
+def use_backend(name=None):
+    """select the ElementTree implementation to parse xml with, 'lxml' or 'etree' (the standard library).
+
+    None picks lxml when it is installed, both give the same output.
+    """
+    global ET, backend
+
+    if name is None:
+        name = 'lxml' if lxml_etree is not None else 'etree'
+
+    if name == 'lxml':
+        if lxml_etree is None:
+            raise ImportError('The lxml backend require "lxml", try install via pip:\n> pip install lxml')
+        ET = lxml_etree
+    elif name == 'etree':
+        ET = ElementTree
+    else:
+        raise ValueError('Not supported xml backend: {}'.format(name))
+
+    backend = name
+
+
+use_backend()
+
+
+def open_xmind(document):
+    """index the comments of an opened `XmindDocument` into a new `ParseContext`, content.xml is streamed later."""
+    context = ParseContext(document)
+
+    if comments_xml in document:
+        content = document.read(comments_xml)
+
+        if content:
+            context.comments = index_comments(content)
+
+    return context
+
+
+def get_sheets(context, convert_node=None, selected=None):
+    """get all sheet as generator and yield.
+
+    content.xml is parsed straight from the archive: every topic is converted by `convert_node`
+    (`node_to_dict` by default) as soon as its end tag is read and its elements are released,
+    so only the converted dicts of the current sheet are kept in memory.
+
+    With a set of sheet indexes in `selected`, the topics of other sheets are released without
+    being converted and the parsing stops after the last selected sheet.
+    """
+    skip = 0
+
+    try:
+        for index, node in iter_sheets(context, convert_node, selected):
+            skip = index + 1
+            yield node
+    except SyntaxError:
+        if ET is not lxml_etree:
+            raise
+
+        # libxml2 refuses very deep topic trees even with huge_tree, go on from the failed sheet with ElementTree
+        logger.debug('lxml failed to parse content.xml, parse it again from sheet {} with ElementTree'.format(skip))
+        context.topics.clear()
+
+        for index, node in iter_sheets(context, convert_node, selected, ElementTree, skip):
+            yield node
+
+
+def iter_sheets(context, convert_node=None, selected=None, etree=None, skip=0):
+    """yield each selected sheet with its index, the sheets before `skip` are not converted, see `get_sheets`."""
+    topics = context.topics
+    convert_node = convert_node or node_to_dict
+    last = max(selected, default=-1) if selected is not None else None
+    index = 0
+    wanted = index >= skip and (selected is None or index in selected)
+
+    if last == -1:
+        return
+
+    reuse = context.subtrees is not None and context.document.size_of(content_xml) <= max_reuse_size
+
+    with context.document.open(content_xml) as source:
+        if convert_node is node_to_topic and (reuse or context.main_topics is not None):
+            content = source.read()
+
+            if context.main_topics is not None:
+                content = skip_main_topics(content, selected, context.main_topics)
+
+            if reuse:
+                content, reused, fingerprints = reuse_subtrees(context, content)
+
+                def convert_node(node, context):
+                    n = node.get(reuse_attr)
+                    if n is not None:
+                        return reused[int(n)]
+
+                    topic = node_to_topic(node, context)
+                    n = node.get(subtree_attr)
+                    if n is not None:
+                        context.subtrees.set(fingerprints[int(n)], topic)
+
+                    return topic
+
+            source = BytesIO(content)
+
+        for name, node in iterparse_content(source, etree):
+            if name == 'topic':
+                if wanted:
+                    topics[node] = convert_node(node, context)
+                del node[:]
+
+            else:
+                if wanted:
+                    yield index, node
+                topics.clear()
+                node.clear()
+
+                index += 1
+                if last is not None and index > last:
+                    return
+
+                wanted = index >= skip and (selected is None or index in selected)
+
+
+def scan_start(content):
+    """the position of the first sheet in content.xml to scan the tags from, or -1 when the tags can't be
+    found by a plain scan: comments, CDATA, entities and processing instructions may hide them, and
+    namespaces may be redeclared."""
+    start = content.find(b'<sheet')
+
+    if start == -1 or b'<!' in content or content.find(b'<?', start) != -1 or content.find(b'xmlns', start) != -1:
+        return -1
+
+    return start
+
+
+def skip_main_topics(content, selected, main_topics):
+    """replace the main topics which `main_topics` doesn't select by empty topics before content.xml is parsed.
+
+    The main topics are the topics attached to the root topics of the `selected` sheets, numbered through
+    the sheets like `xmindparser.iter_xmind_data(main_topics=...)` does.
+    """
+    start = scan_start(content)
+
+    if start == -1:
+        return content
+
+    pieces = []
+    pos, depth, sheet, number, begin = 0, 0, -1, 0, None
+    wanted = attached = False
+
+    for m in outline_tag.finditer(content, start):
+        end, name, attributes, empty = m.groups()
+
+        if name == b'sheet':
+            if not end:
+                sheet += 1
+                wanted = selected is None or sheet in selected
+            continue
+
+        if name == b'topics':
+            if depth == 1 and not empty:
+                attached = not end and attached_type.search(attributes) is not None
+            continue
+
+        if end:
+            depth -= 1
+
+            if depth == 1 and begin is not None:
+                pieces.append(content[pos:begin])
+                pieces.append(b'<topic/>')
+                pos, begin = m.end(), None
+            continue
+
+        if depth == 1 and attached and wanted:
+            number += 1
+
+            if not main_topics(number - 1):
+                if empty:
+                    pieces.append(content[pos:m.start()])
+                    pieces.append(b'<topic/>')
+                    pos = m.end()
+                else:
+                    begin = m.start()
+
+        if not empty:
+            depth += 1
+
+    pieces.append(content[pos:])
+    return b''.join(pieces)
+
+
+def reuse_subtrees(context, content):
+    """replace each topic subtree right below a root topic which is unchanged since the last conversion
+    by an empty placeholder topic, before content.xml is parsed.
+
+    A subtree is fingerprinted by its bytes in content.xml together with everything else its conversion
+    depends on, `context.subtrees` maps the fingerprints to the `Topic` converted last time. Returns the
+    content to parse, the reused topics and the fingerprints of the subtrees to convert by their numbers,
+    which the placeholders and the converted subtrees carry in `reuse_attr` and `subtree_attr`.
+    """
+    start = scan_start(content)
+
+    if start == -1:
+        return content, {}, {}
+
+    comments = context.document.read(comments_xml) if comments_xml in context.document else b''
+    salt = hashlib.sha1(content[:start] + comments + repr(sorted(config.items())).encode('utf-8')).digest()
+    pieces, reused, fingerprints = [], {}, {}
+    depth, pos, begin = 0, 0, 0
+
+    for m in topic_tag.finditer(content, start):
+        if m.group(1):
+            depth -= 1
+            if depth != 1:
+                continue
+        elif not m.group(2):
+            if depth == 1:
+                begin = m.start()
+            depth += 1
+            continue
+        elif depth == 1:
+            begin = m.start()
+        else:
+            continue
+
+        # the end of a subtree right below a root topic
+        subtree = content[begin:m.end()]
+        fingerprint = hashlib.sha1(salt + subtree).digest()
+        topic = context.subtrees.get(fingerprint)
+        n = len(pieces)
+        pieces.append(content[pos:begin])
+
+        if topic is not None:
+            reused[n] = topic
+            pieces.append(b'<topic %s="%d"/>' % (reuse_attr.encode('ascii'), n))
+        else:
+            fingerprints[n] = fingerprint
+            pieces.append(b'<topic %s="%d"%s' % (subtree_attr.encode('ascii'), n, subtree[6:]))
+
+        pos = m.end()
+
+    pieces.append(content[pos:])
+    return b''.join(pieces), reused, fingerprints
+
+
+def get_sheet_titles(context):
+    """list the sheet titles, content.xml is only parsed without converting any topic."""
+    try:
+        return _get_sheet_titles(context)
+    except SyntaxError:
+        if ET is not lxml_etree:
+            raise
+
+        return _get_sheet_titles(context, ElementTree)
+
+
+def _get_sheet_titles(context, etree=None):
+    titles = []
+
+    with context.document.open(content_xml) as source:
+        for name, node in iterparse_content(source, etree):
+            if name == 'topic':
+                del node[:]
+            else:
+                titles.append(text_of(parts_of(node).get('title')))
+                node.clear()
+
+    return titles
+
 
+def iterparse_content(source, etree=None):
+    """iterparse content.xml and yield the local tag name and element of each topic and sheet once it is complete.
 
-def open_xmind(file_path):
-    """open xmind as zip file and cache the content."""
-    cache.clear()
-    with ZipFile(file_path) as xmind:
-        for f in xmind.namelist():
-            for key in [content_xml, comments_xml]:
-                if f == key:
-                    cache[key] = xmind.open(f).read().decode('utf-8')
+    The tags keep their namespace, they are only matched by local name. lxml reports
+    nothing but the topics and sheets to python, ElementTree reports every element.
+    """
+    etree = etree or ET
 
+    if etree is lxml_etree:
+        # deep topic trees exceed the default depth limit of libxml2
+        for _, node in etree.iterparse(source, tag=('{*}topic', '{*}sheet'), huge_tree=True,
+                                       remove_comments=True, remove_pis=True, resolve_entities=False):
+            yield local_name(node.tag), node
+    else:
+        for _, node in etree.iterparse(source):
+            tag = node.tag
+            name = tag[tag.find('}') + 1:]
 
-def get_sheets():
-    """get all sheet as generator and yield."""
-    tree = xmind_content_to_etree(cache[content_xml])
-    assert isinstance(tree, Element)
+            if name == 'topic' or name == 'sheet':
+                yield name, node
 
-    for sheet in tree.findall('sheet'):
-        yield sheet
 
+def local_name(tag):
+    """the tag without its namespace."""
+    return tag[tag.find('}') + 1:]
 
-def sheet_to_dict(sheet):
+
+def iterparse(source, etree=None):
+    """iterparse a xmind xml stream and yield every element once it is complete.
+
+    Namespaces are dropped from the tags and from xlink:href on the fly, an element
+    is renamed before its parent is yielded. `etree` overrides the backend in use.
+    """
+    etree = etree or ET
+
+    if etree is lxml_etree:
+        events = etree.iterparse(source, huge_tree=True, remove_comments=True, remove_pis=True, resolve_entities=False)
+    else:
+        events = etree.iterparse(source)
+
+    for _, node in events:
+        tag = node.tag
+
+        if tag[0] == '{':
+            node.tag = tag[tag.index('}') + 1:]
+
+        href = node.get(xlink_href)
+
+        if href is not None:
+            del node.attrib[xlink_href]
+            node.set('href', href)
+
+        yield node
+
+
+def sheet_to_dict(sheet, context=None):
     """convert a sheet to dict type."""
-    topic = sheet.find('topic')
-    result = {'title': title_of(sheet), 'topic': node_to_dict(topic), 'structure': get_sheet_structure(sheet)}
+    parts = parts_of(sheet)
+    topic = parts.get('topic')
+    result = {'title': title_of(sheet, parts), 'topic': node_to_dict(topic, context), 'structure': get_sheet_structure(sheet)}
 
     if config['showTopicId']:
         result['id'] = sheet.attrib['id']
@@ -43,19 +373,24 @@ def sheet_to_dict(sheet):
 
 
 def get_sheet_structure(sheet):
-    root_topic = sheet.find('topic')
-    return root_topic.attrib.get('structure-class', None)
+    root_topic = parts_of(sheet).get('topic')
+    return root_topic.get('structure-class', None)
 
 
-def node_to_dict(node):
-    """parse Element to dict data type."""
-    child = children_topics_of(node)
+def node_to_dict(node, context=None):
+    """parse Element to dict data type, topics already converted by `get_sheets` are taken from the context."""
+    if context and node in context.topics:
+        return context.topics.pop(node)
 
-    d = {'title': title_of(node),
-         'comment': comments_of(node),
-         'note': note_of(node),
-         'makers': maker_of(node),
-         'labels': labels_of(node),
+    parts = parts_of(node)
+    child = children_topics_of(node, parts)
+    context = convert_descendants(child if child is not None else (), node_to_dict, context)
+
+    d = {'title': title_of(node, parts),
+         'comment': comments_of(node, context),
+         'note': note_of(node, parts),
+         'makers': maker_of(node, parts),
+         'labels': labels_of(node, parts),
          'link': link_of(node)}
 
     if d['link']:
@@ -67,10 +402,10 @@ def node_to_dict(node):
             del d['link']
             d['title'] = '[Attachment]{0}'.format(d['title'])
 
-    if child:
+    if child is not None and len(child):
         d['topics'] = []
         for c in child:
-            d['topics'].append(node_to_dict(c))
+            d['topics'].append(node_to_dict(c, context))
 
     if config['showTopicId']:
         d['id'] = id_of(node)
@@ -81,16 +416,97 @@ def node_to_dict(node):
     return d
 
 
+def sheet_to_data(sheet, context=None, convert_node=None):
+    """convert a sheet to the dict type of `xmind` package `SheetElement.getData()`.
+
+    The topics are converted by `convert_node`, `node_to_data` by default or `node_to_topic`.
+    """
+    convert_node = convert_node or node_to_data
+    parts = parts_of(sheet)
+    return {'id': id_of(sheet),
+            'title': text_of(parts.get('title')),
+            'topic': convert_node(parts.get('topic'), context)}
+
+
+def node_to_data(node, context=None):
+    """parse Element to the dict type of `xmind` package `TopicElement.getData()`, which xmind2testcase consumes.
+
+    Topics already converted by `get_sheets(context, node_to_data)` are taken from the context.
+    """
+    if context and node in context.topics:
+        return context.topics.pop(node)
+
+    parts = parts_of(node)
+    child = children_topics_of(node, parts)
+    child = children_of(child, 'topic') if child is not None else []
+    context = convert_descendants(child, node_to_data, context)
+    d = {'id': id_of(node),
+         'link': link_of(node),
+         'title': text_of(parts.get('title')),
+         'note': plain_note_of(node, parts),
+         'label': label_of(node, parts),
+         'comment': comment_of(node, context),
+         'markers': maker_of(node, parts) or []}
+
+    if child:
+        d['topics'] = []
+        for c in child:
+            d['topics'].append(node_to_data(c, context))
+
+    return d
+
+
+def node_to_topic(node, context=None):
+    """parse Element to compact `Topic`, the same data as `node_to_data` with less memory."""
+    if context and node in context.topics:
+        return context.topics.pop(node)
+
+    parts = parts_of(node)
+    child = children_topics_of(node, parts)
+    child = children_of(child, 'topic') if child is not None else []
+    context = convert_descendants(child, node_to_topic, context)
+    topic = Topic(id_of(node), text_of(parts.get('title')), plain_note_of(node, parts), label_of(node, parts),
+                  comment_of(node, context), maker_of(node, parts), link_of(node))
+
+    if child:
+        topic.topics = [node_to_topic(c, context) for c in child]
+
+    return topic
+
+
+def convert_descendants(topics, convert_node, context=None):
+    """convert the `topics` and the attached topics below them into `context.topics`, deepest first and without recursion.
+
+    `convert_node` then finds the converted children in the context, however deep the topic tree is.
+    Topics already in the context are skipped with their descendants, as `get_sheets` converts them bottom up.
+    """
+    context = context or ParseContext(None)
+    pending = []
+    stack = [c for c in topics if c not in context.topics]
+
+    while stack:
+        node = stack.pop()
+        pending.append(node)
+        child = children_topics_of(node)
+
+        if child is not None:
+            stack.extend(c for c in child if c not in context.topics)
+
+    for c in reversed(pending):
+        context.topics[c] = convert_node(c, context)
+
+    return context
+
+
 def xmind_content_to_etree(content):
-    # Remove the default namespace definition (xmlns="http://some/namespace")
-    xml_content = re.sub(r'\sxmlns="[^"]+"', '', content, count=1)
+    if isinstance(content, str):
+        content = content.encode('utf-8')
 
-    # Replace xml tag with namespace
-    xml_content = xml_content.replace('<xhtml:img', '<img')
+    root = None
+    for node in iterparse(BytesIO(content)):
+        root = node
 
-    # Replace link attrib with namespace
-    xml_content = xml_content.replace('xlink:href', 'href')
-    return ET.fromstring(xml_content.encode('utf-8'))
+    return root
 
 
 def xmind_xml_to_etree(xml_path):
@@ -99,89 +515,142 @@ def xmind_xml_to_etree(xml_path):
         return xmind_content_to_etree(content)
 
 
-def comments_of(node):
-    if cache.get(comments_xml, None):
+def index_comments(content):
+    """parse comments.xml once and group the comments by the topic id they belong to."""
+    index = {}
+
+    for c in xmind_content_to_etree(content).findall('comment'):
+        node_id = c.attrib['object-id']
+        i = {'author': c.attrib['author'], 'content': c.find('content').text}
+
+        if config['showTopicId']:
+            i['id'] = node_id
+
+        index.setdefault(node_id, []).append(i)
+
+    return index
+
+
+def comments_of(node, context=None):
+    if context and context.comments:
         node_id = node.attrib.get('id', None)
 
         if node_id:
-            xml_root = xmind_content_to_etree(cache[comments_xml])
-            result = []
+            result = context.comments.get(node_id, None)
+            return list(result) if result else None
+
 
-            for c in xml_root.findall('comment'):
+def comment_of(node, context=None):
+    """all comments content of a topic in a string, one comment per line."""
+    comments = comments_of(node, context)
 
-                if c.attrib['object-id'] == node_id:
-                    i = {'author': c.attrib['author'], 'content': c.find('content').text}
+    if comments:
+        return '\n'.join(c['content'] or '' for c in comments)
 
-                    if config['showTopicId']:
-                        i['id'] = c.attrib['object-id']
 
-                    result.append(i)
+def parts_of(node):
+    """index the child elements of a topic by local name in a single pass, the first one of each name like `find`."""
+    parts = {}
 
-            return result if result else None
+    for child in node:
+        tag = child.tag
+        name = tag[tag.find('}') + 1:]  # `local_name` inlined, it is called for every child of every topic
+
+        if name not in parts:
+            parts[name] = child
+
+    return parts
+
+
+def children_of(node, name):
+    """all child elements with the local name, like `findall`."""
+    return [child for child in node if local_name(child.tag) == name]
 
 
 def id_of(node):
-    return node.attrib.get('id', None)
+    return node.get('id', None)
 
 
-def image_of(node):
-    img = node.find('img')
+def image_of(node, parts=None):
+    parts = parts_of(node) if parts is None else parts
 
-    if img is not None:
+    if parts.get('img') is not None:
         return '[Image]'
 
 
 def link_of(node):
-    return node.attrib.get('href', None)
+    href = node.get(xlink_href, None)
+    return href if href is not None else node.get('href', None)
 
 
-def title_of(node):
-    if image_of(node):
-        return image_of(node)
+def title_of(node, parts=None):
+    parts = parts_of(node) if parts is None else parts
+    image = image_of(node, parts)
 
-    title = node.find('title')
+    if image:
+        return image
 
-    if title is not None:
-        return title.text
+    return text_of(parts.get('title'))
 
 
-def labels_of(node):
-    label_node = node.find('labels')
+def text_of(node):
+    if node is not None:
+        return node.text
+
+
+def labels_of(node, parts=None):
+    label_node = (parts_of(node) if parts is None else parts).get('labels')
 
     if label_node is not None:
         labels = []
-        for _ in label_node.findall('label'):
+        for _ in children_of(label_node, 'label'):
             labels.append(_.text)
 
         return labels if labels else None
 
 
-def note_of(node):
-    note_node = node.find('notes')
+def note_of(node, parts=None):
+    note_node = (parts_of(node) if parts is None else parts).get('notes')
 
     if note_node is not None:
-        note = note_node.find('plain').text
+        note = parts_of(note_node).get('plain').text
         return note.strip()
 
 
+def label_of(node, parts=None):
+    label_node = (parts_of(node) if parts is None else parts).get('labels')
+
+    if label_node is not None:
+        return text_of(parts_of(label_node).get('label'))
+
+
+def plain_note_of(node, parts=None):
+    note_node = (parts_of(node) if parts is None else parts).get('notes')
+
+    if note_node is not None:
+        return text_of(parts_of(note_node).get('plain'))
+
+
 def debug_node(node, comments):
     s = ET.tostring(node)
     logger.debug('{}: {}'.format(comments, s))
     return s
 
 
-def maker_of(topic_node):
-    maker_node = topic_node.find('marker-refs')
+def maker_of(topic_node, parts=None):
+    maker_node = (parts_of(topic_node) if parts is None else parts).get('marker-refs')
     if maker_node is not None:
         makers = []
         for maker in maker_node:
-            makers.append(maker.attrib['marker-id'])
+            makers.append(maker.get('marker-id', None))
 
         return makers
 
 
-def children_topics_of(topic_node):
-    children = topic_node.find('children')
+def children_topics_of(topic_node, parts=None):
+    children = (parts_of(topic_node) if parts is None else parts).get('children')
 
     if children is not None:
-        return children.find('./topics[@type="attached"]')
+        for topics in children:
+            if local_name(topics.tag) == 'topics' and topics.get('type') == 'attached':
+                return topics
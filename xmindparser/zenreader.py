@@ -1,31 +1,142 @@
+import hashlib
+import io
 import json
-from zipfile import ZipFile
 
-from . import config, cache
+from . import codec, config, ParseContext, Topic
 
 content_json = "content.json"
+chunk_size = 64 * 1024
 
+# the largest content.json in bytes (uncompressed) which orjson decodes at once, a larger one is decoded
+# one sheet at a time like without orjson, so the memory stays bounded by the largest sheet
+max_load_size = 4 * 1024 * 1024
 
-def open_xmind(file_path):
-    """open xmind as zip file and cache the content."""
-    cache.clear()
-    with ZipFile(file_path) as xmind:
-        for f in xmind.namelist():
-            for key in [content_json]:
-                if f == key:
-                    cache[key] = xmind.open(f).read().decode('utf-8')
 
+def open_xmind(document):
+    """create the `ParseContext` of an opened `XmindDocument`, content.json is streamed by `get_sheets`."""
+    return ParseContext(document)
 
-def get_sheets():
-    """get all sheet as generator and yield."""
-    for sheet in json.loads(cache[content_json]):
-        yield sheet
 
+def get_sheets(context, selected=None):
+    """get all sheet as generator and yield.
 
-def sheet_to_dict(sheet):
-    """convert a sheet to dict type."""
+    With a set of sheet indexes in `selected` only those sheets are yielded and the
+    decoding stops after the last one.
+    """
+    last = max(selected, default=-1) if selected is not None else None
+
+    if last == -1:
+        return
+
+    for index, sheet in enumerate(iter_content_sheets(context)):
+        if selected is None or index in selected:
+            yield sheet
+
+        if last is not None and index >= last:
+            return
+
+
+def iter_content_sheets(context):
+    """decode the sheets of content.json.
+
+    content.json is decoded from the archive one sheet at a time, so only the current sheet is kept
+    in memory instead of the whole workbook. orjson decodes a content.json up to `max_load_size`
+    at once instead, each sheet is released after it is yielded.
+    """
+    document = context.document
+
+    with document.open(content_json) as source:
+        if codec.orjson is None or document.size_of(content_json) > max_load_size:
+            for sheet in iter_json_array(source):
+                yield sheet
+            return
+
+        sheets = codec.loads(source.read())
+
+    if not isinstance(sheets, list):
+        raise ValueError('content.json is not a json array!')
+
+    sheets.reverse()
+
+    while sheets:
+        yield sheets.pop()
+
+
+def get_sheet_titles(context):
+    """list the sheet titles, each sheet is decoded but none is converted."""
+    return [sheet['title'] for sheet in get_sheets(context)]
+
+
+def iter_json_array(source):
+    """decode a json array from a binary stream and yield its items one by one."""
+    reader = io.TextIOWrapper(source, encoding='utf-8')
+    buffer, pos, eof = '', 0, False
+
+    def read_more(size):
+        nonlocal buffer, pos, eof
+        data = reader.read(max(size, chunk_size))
+        eof = not data
+        buffer, pos = buffer[pos:] + data, 0
+
+    def next_char():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+
+            read_more(chunk_size)
+
+    if next_char() != '[':
+        raise ValueError('content.json is not a json array!')
+
+    pos += 1
+    if next_char() == ']':
+        return
+
+    while True:
+        next_char()
+        try:
+            item, end = codec.raw_decode(buffer, pos)  # a very deep sheet is decoded without recursion
+            complete = end < len(buffer) or eof
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+
+        if not complete:
+            # double the buffer on every retry, an item is decoded again at most log(n) times
+            read_more(len(buffer) - pos)
+            continue
+
+        pos = end
+        yield item
+        del item
+
+        char = next_char()
+        if char == ']':
+            return
+
+        if char != ',':
+            raise ValueError('content.json is not a valid json array!')
+
+        pos += 1
+
+
+def sheet_to_dict(sheet, context=None, convert_node=None):
+    """convert a sheet to dict type, the topics are converted by `convert_node` (`node_to_dict` by default)."""
     topic = sheet['rootTopic']
-    result = {'title': sheet['title'], 'topic': node_to_dict(topic), 'structure': get_sheet_structure(sheet)}
+    convert_node = convert_node or node_to_dict
+
+    if convert_node is node_to_topic and context is not None and (
+            context.subtrees is not None or context.main_topics is not None):
+        root = root_to_topic(topic, context)
+    else:
+        root = convert_node(topic)
+
+    result = {'title': sheet['title'], 'topic': root, 'structure': get_sheet_structure(sheet)}
 
     if config['showTopicId']:
         result['id'] = sheet['id']
@@ -42,9 +153,90 @@ def get_sheet_structure(sheet):
 
 
 def node_to_dict(node):
-    """parse Element to dict data type."""
+    """parse Element to dict data type, the topic tree is walked with an explicit stack instead of recursion."""
+    d = topic_to_dict(node)
+    stack = [(node, d)]
+
+    while stack:
+        node, parent = stack.pop()
+        child = children_topics_of(node)
+
+        if child:
+            parent['topics'] = []
+            for c in child:
+                sub_topic = topic_to_dict(c)
+                parent['topics'].append(sub_topic)
+                stack.append((c, sub_topic))
+
+    return d
+
+
+def node_to_topic(node):
+    """parse a topic tree to compact `Topic`, the same data as `node_to_dict` with less memory."""
+    t = topic_to_topic(node)
+    stack = [(node, t)]
+
+    while stack:
+        node, parent = stack.pop()
+        child = children_topics_of(node)
+
+        if child:
+            parent.topics = []
+            for c in child:
+                sub_topic = topic_to_topic(c)
+                parent.topics.append(sub_topic)
+                stack.append((c, sub_topic))
+
+    return t
+
+
+def root_to_topic(node, context):
+    """parse a root topic like `node_to_topic`, only the main topics selected by `context.main_topics` are
+    converted and empty topics are put in place of the others. Each main topic which is unchanged since the
+    last conversion is reused from `context.subtrees` by the fingerprint of its json."""
+    t = topic_to_topic(node)
     child = children_topics_of(node)
 
+    if child:
+        salt = codec.dumps(sorted(config.items()))
+        t.topics = []
+        for c in child:
+            number = context.main_topic_count
+            context.main_topic_count += 1
+
+            if context.main_topics is not None and not context.main_topics(number):
+                t.topics.append(Topic())
+                continue
+
+            if context.subtrees is None:
+                t.topics.append(node_to_topic(c))
+                continue
+
+            try:
+                fingerprint = hashlib.sha1(salt + codec.dumps(c)).digest()
+            except RecursionError:
+                t.topics.append(node_to_topic(c))  # too deep for the json encoders, it is converted every time
+                continue
+
+            sub_topic = context.subtrees.get(fingerprint)
+
+            if sub_topic is None:
+                sub_topic = node_to_topic(c)
+                context.subtrees.set(fingerprint, sub_topic)
+
+            t.topics.append(sub_topic)
+
+    return t
+
+
+def topic_to_topic(node):
+    """parse a single topic to `Topic`, without its sub topics."""
+    d = topic_to_dict(node)
+    return Topic(d['id'], d['title'], d['note'], d['label'], d['comment'], d['markers'], d.get('link', None), d['image'])
+
+
+def topic_to_dict(node):
+    """parse a single topic to dict data type, without its sub topics."""
     d = {
         'id': '',
         'title': node.get('title', ''),
@@ -66,11 +258,6 @@ def node_to_dict(node):
             del d['link']
             d['title'] = '[Attachment]{0}'.format(d['title'])
 
-    if child:
-        d['topics'] = []
-        for c in child:
-            d['topics'].append(node_to_dict(c))
-
     if config['showTopicId']:
         d['id'] = node['id']
 